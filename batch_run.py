@@ -0,0 +1,135 @@
+"""
+Run scripted game sessions concurrently, for evaluating prompt and rule changes.
+
+A scenario script (JSON or YAML) names a module and the player inputs to send:
+
+    name: scary_fall_smoke
+    module: scary_fall.docx
+    inputs:
+      - 我想创建一个调查员，他是一名图书馆员。
+      - 我走进图书馆，环顾四周。
+
+    python batch_run.py scripts/*.yaml --concurrency 8 --output runs/
+"""
+import os
+import json
+import time
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from main import load_module_from_doc
+from src.game import CoCGame
+from src.cassette import Cassette
+
+_module_cache: Dict[str, List[str]] = {}
+_module_lock = threading.Lock()
+
+
+def load_script(path: str) -> Dict[str, Any]:
+    """Load a scenario script from a JSON or YAML file."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            script = json.load(f)
+        else:
+            import yaml  # Only needed for YAML scripts
+            script = yaml.safe_load(f)
+    script.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    if not script.get("module") or not script.get("inputs"):
+        raise ValueError(f"Script {path} needs a module and a list of inputs")
+    return script
+
+
+def _module_texts(module_name: str) -> List[str]:
+    """Module paragraphs, read from docs/ once per process."""
+    with _module_lock:
+        if module_name not in _module_cache:
+            _module_cache[module_name] = load_module_from_doc(os.path.join("docs", module_name))
+        return _module_cache[module_name]
+
+
+def run_session(script: Dict[str, Any], session_id: str, output_dir: str, game_options: Dict[str, Any]) -> Dict[str, Any]:
+    """Play one scripted session and write its transcript and metrics."""
+    # A cassette file per session: sessions run concurrently, and the session
+    # id is stable across runs so a replay finds its recording
+    game = CoCGame(metrics_path=os.path.join(output_dir, f"{session_id}.metrics.jsonl"),
+                   cassette=Cassette.from_env(session=session_id), **game_options)
+    game.load_module(_module_texts(script["module"]))
+
+    transcript = []
+    for player_input in script["inputs"]:
+        try:
+            response = game.process_player_input(player_input)
+            error = None
+        except Exception as e:
+            response, error = None, str(e)
+        transcript.append({
+            "turn": len(transcript) + 1,
+            "input": player_input,
+            "response": response,
+            "error": error,
+            "stop_reason": game.metrics.turns[-1].stop_reason if game.metrics.turns else None
+        })
+
+    with open(os.path.join(output_dir, f"{session_id}.transcript.json"), "w", encoding="utf-8") as f:
+        json.dump({"session": session_id, "script": script["name"], "module": script["module"], "turns": transcript},
+                  f, ensure_ascii=False, indent=2)
+    return {"session": session_id, "script": script["name"], **game.metrics.summary()}
+
+
+def main(script_paths: List[str], concurrency: int, repeat: int, output_dir: str, game_options: Dict[str, Any]):
+    load_dotenv()
+    os.makedirs(output_dir, exist_ok=True)
+    scripts = [load_script(path) for path in script_paths]
+    sessions = [
+        (script, f"{script['name']}-{i + 1}")
+        for script in scripts
+        for i in range(repeat)
+    ]
+
+    print(f"Running {len(sessions)} sessions with concurrency {concurrency}...")
+    start = time.perf_counter()
+    summaries = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="coc-session") as executor:
+        futures = {
+            executor.submit(run_session, script, session_id, output_dir, game_options): session_id
+            for script, session_id in sessions
+        }
+        for future in as_completed(futures):
+            session_id = futures[future]
+            try:
+                summaries.append(future.result())
+                print(f"Session {session_id} done.")
+            except Exception as e:
+                summaries.append({"session": session_id, "error": str(e)})
+                print(f"Session {session_id} failed: {e}")
+
+    elapsed = time.perf_counter() - start
+    turns = sum(s.get("turns", 0) for s in summaries)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "sessions": len(sessions),
+            "concurrency": concurrency,
+            "wall_seconds": round(elapsed, 3),
+            "turns_per_second": round(turns / elapsed, 3) if elapsed else 0.0,
+            "session_summaries": sorted(summaries, key=lambda s: s["session"])
+        }, f, ensure_ascii=False, indent=2)
+    print(f"{turns} turns in {elapsed:.1f}s, results in {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Run scripted CoC sessions concurrently")
+    parser.add_argument("scripts", nargs="+", help="Scenario scripts (JSON or YAML)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Sessions run at the same time")
+    parser.add_argument("-n", "--repeat", type=int, default=1, help="Sessions per script")
+    parser.add_argument("-o", "--output", type=str, default=os.path.join("runs", time.strftime("%Y%m%d-%H%M%S")),
+                        help="Directory for transcripts and metrics")
+    parser.add_argument("--scenario-mode", choices=["retrieval", "full"], default="retrieval")
+    parser.add_argument("--all-tools", action="store_true", help="Send every tool schema instead of routing")
+    args = parser.parse_args()
+    main(args.scripts, args.concurrency, args.repeat, args.output, {
+        "scenario_mode": args.scenario_mode,
+        "route_tools": not args.all_tools,
+    })
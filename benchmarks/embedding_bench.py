@@ -0,0 +1,199 @@
+"""
+Embedding benchmark: cold load, query latency, batch throughput and peak memory
+of each model and backend, on the rule PDFs and the module paragraphs.
+
+    python benchmarks/embedding_bench.py --models all-mpnet-base-v2 all-MiniLM-L6-v2 --backends torch onnx
+
+Every (model, backend) pair runs in its own process, so load time and peak RSS
+are measured from a clean start. Results are written as JSON to
+benchmarks/results/ for comparison between runs.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import subprocess
+import tempfile
+from argparse import SUPPRESS, ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+MODELS = ["all-mpnet-base-v2", "all-MiniLM-L6-v2", "multi-qa-mpnet-base-dot-v1", "e5-large-v2"]
+
+
+def _chunk(text: str, size: int = 500) -> List[str]:
+    """Cut a page into paragraph-aligned chunks of about `size` characters."""
+    chunks, current = [], ""
+    for paragraph in text.split("\n\n"):
+        if current and len(current) + len(paragraph) > size:
+            chunks.append(current.strip())
+            current = ""
+        current += paragraph + "\n\n"
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+
+def load_corpus(rules_dir: str, module_path: str, max_texts: int) -> List[str]:
+    """Rule chunks and module paragraphs, shuffled with a fixed seed."""
+    import PyPDF2
+    from main import load_module_from_doc
+
+    texts = []
+    for filename in sorted(os.listdir(rules_dir)):
+        if filename.endswith(".pdf"):
+            for page in PyPDF2.PdfReader(os.path.join(rules_dir, filename)).pages:
+                texts.extend(_chunk(page.extract_text() or ""))
+    if os.path.exists(module_path):
+        texts.extend(load_module_from_doc(module_path))
+    texts = [text for text in texts if text.strip()]
+    random.Random(0).shuffle(texts)
+    return texts[:max_texts]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _load(model_name: str, backend: str, threads: int):
+    if backend == "onnx":
+        # Not default_model_dir: EMBEDDING_ONNX_DIR would point every model at the same export
+        from src.onnx_embeddings import OnnxModel, model_dir
+        return OnnxModel(model_dir(model_name), num_threads=threads)
+    import torch
+    torch.set_num_threads(threads)
+    from src.embeddings import get_model
+    return get_model(model_name, "cpu", backend)
+
+
+def run_worker(model_name: str, backend: str, corpus_path: str, queries: int,
+               batch_sizes: List[int], thread_counts: List[int], sample: int) -> Dict[str, Any]:
+    """Benchmark one model and backend in this process."""
+    with open(corpus_path, encoding="utf-8") as f:
+        texts = json.load(f)
+
+    start = time.perf_counter()
+    model = _load(model_name, backend, max(thread_counts))
+    cold_load = time.perf_counter() - start
+    model.encode(texts[:1])  # first call allocates buffers
+
+    latencies = []
+    for text in texts[:queries]:
+        start = time.perf_counter()
+        model.encode([text])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    throughput = []
+    subset = texts[:sample]
+    for threads in thread_counts:
+        model = _load(model_name, backend, threads) if backend == "onnx" else model
+        if backend == "torch":
+            import torch
+            torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            for i in range(0, len(subset), batch_size):
+                model.encode(subset[i:i + batch_size], batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            throughput.append({
+                "threads": threads,
+                "batch_size": batch_size,
+                "texts_per_second": round(len(subset) / elapsed, 2),
+            })
+
+    return {
+        "model": model_name,
+        "backend": backend,
+        "dimension": model.dimension,
+        "cold_load_seconds": round(cold_load, 3),
+        "query_latency_ms_p50": round(_percentile(latencies, 0.5), 2),
+        "query_latency_ms_p99": round(_percentile(latencies, 0.99), 2),
+        "throughput": throughput,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main(args) -> None:
+    texts = load_corpus(args.rules_dir, args.module, args.max_texts)
+    print(f"Corpus: {len(texts)} texts")
+    results = []
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+        json.dump(texts, f, ensure_ascii=False)
+        corpus_path = f.name
+    try:
+        for model_name in args.models:
+            for backend in args.backends:
+                print(f"Benchmarking {model_name} ({backend})...")
+                command = [
+                    sys.executable, __file__, "--worker", model_name, backend, "--corpus", corpus_path,
+                    "--queries", str(args.queries), "--sample", str(args.sample),
+                    "--batch-sizes", *map(str, args.batch_sizes), "--threads", *map(str, args.threads),
+                ]
+                # Keep the workers away from the shared on-disk embedding cache
+                env = {**os.environ, "EMBEDDING_CACHE": "off"}
+                process = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, env=env)
+                if process.returncode != 0:
+                    print(f"  failed: {process.stderr.strip().splitlines()[-1:]}")
+                    results.append({"model": model_name, "backend": backend, "error": process.stderr[-2000:]})
+                    continue
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+                print(f"  load {result['cold_load_seconds']}s, p50 {result['query_latency_ms_p50']}ms, "
+                      f"p99 {result['query_latency_ms_p99']}ms, peak RSS {result['peak_rss_mb']}MB")
+                results.append(result)
+    finally:
+        os.remove(corpus_path)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "corpus_texts": len(texts),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark embedding models and backends")
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--backends", nargs="+", choices=["torch", "onnx"], default=["torch"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32, 64])
+    parser.add_argument("--threads", nargs="+", type=int, default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--queries", type=int, default=200, help="Single-text queries timed for latency")
+    parser.add_argument("--sample", type=int, default=512, help="Texts encoded per throughput measurement")
+    parser.add_argument("--max-texts", type=int, default=2000, help="Corpus size")
+    parser.add_argument("--rules-dir", default=str(ROOT / "split_rules"))
+    parser.add_argument("--module", default=str(ROOT / "docs" / "scary_fall.docx"))
+    parser.add_argument("--output", default=str(ROOT / "benchmarks" / "results" / f"embedding-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    # Internal: benchmark one model in a child process
+    parser.add_argument("--worker", nargs=2, metavar=("MODEL", "BACKEND"), help=SUPPRESS)
+    parser.add_argument("--corpus", help=SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args.worker[0], args.worker[1], args.corpus, args.queries,
+                                    args.batch_sizes, args.threads, args.sample)))
+    else:
+        main(args)
@@ -1,12 +1,15 @@
 import os
+import logging
 from dotenv import load_dotenv
-from src.game import CoCGame
-from docx import Document
 from argparse import ArgumentParser
-import PyPDF2  # Added import for PDF handling
+from concurrent.futures import ThreadPoolExecutor
+
+# The game (embedding model, faiss, database, LLM client) is imported in the
+# background by `start_game`, so the CLI starts instantly.
 
 def load_module_from_doc(doc_path: str) -> list:
     """Load module text from a .doc file."""
+    from docx import Document
     doc = Document(doc_path)
     texts = []
     for paragraph in doc.paragraphs:
@@ -14,30 +17,72 @@ def load_module_from_doc(doc_path: str) -> list:
             texts.append(paragraph.text)
     return texts
 
-def main(module_name: str):
+def start_game(module_name: str, **game_options):
+    """Build the game and load its module."""
+    from src.game import CoCGame
+    game = CoCGame(**game_options)
+    game.load_module(load_module_from_doc(os.path.join("docs", module_name)))
+    return game
+
+def main(module_name: str, stream: bool = True, scenario_mode: str = "retrieval", metrics_path: str = None,
+         route_tools: bool = True):
     load_dotenv()
+    # Library INFO logs would interleave with the streamed response
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
     
-    # Initialize game
-    game = CoCGame()
-    
-    # Load module
-    module_path = os.path.join("docs", module_name)
-    module_texts = load_module_from_doc(module_path)
-    game.load_module(module_texts)
+    # Load the model, connect to the database and load the module while the player types
+    warmup = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup")
+    game_options = dict(scenario_mode=scenario_mode, metrics_path=metrics_path, route_tools=route_tools)
+    startup = warmup.submit(start_game, module_name, **game_options)
+    game = None
     
     print("Welcome to the Call of Cthulhu game!")
     print("Type 'quit' to exit the game.")
     
-    while True:
-        player_input = input("\nYou: ").strip()
-        if player_input.lower() == 'quit':
-            break
-            
-        response = game.process_player_input(player_input)
-        print(f"\nGame Master: {response}")
+    try:
+        while True:
+            player_input = input("\nYou: ").strip()
+            if player_input.lower() == 'quit':
+                break
+            if game is None:
+                if not startup.done():
+                    print("Loading the game...")
+                try:
+                    game = startup.result()
+                except Exception as e:
+                    # e.g. the database is down; try again on the next input
+                    print(f"\n<Error: The game failed to start: {e}/> Please try again.")
+                    startup = warmup.submit(start_game, module_name, **game_options)
+                    continue
+                
+            try:
+                if stream:
+                    # Print tokens as they arrive instead of waiting for the whole turn
+                    print("\nGame Master: ", end="", flush=True)
+                    for delta in game.stream_player_input(player_input):
+                        print(delta, end="", flush=True)
+                    print()
+                else:
+                    response = game.process_player_input(player_input)
+                    print(f"\nGame Master: {response}")
+            except Exception as e:
+                # The LLM client already retried and failed over; keep the session alive
+                print(f"\n<Error: {e}/> Please try again.")
+    finally:
+        # Don't wait for a warmup still running when the player quits
+        warmup.shutdown(wait=False, cancel_futures=True)
+
+    if game is not None and game.metrics.turns:
+        print(f"\nSession metrics:\n{game.metrics.format_summary()}")
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("-m", "--module", type=str, default="scary_fall.docx", help="Module name")
+    parser.add_argument("--no-stream", action="store_true", help="Wait for the full response instead of streaming it")
+    parser.add_argument("--scenario-mode", choices=["retrieval", "full"], default="retrieval",
+                        help="Retrieve module passages per turn, or put the whole module in the system prompt")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-turn metrics to this JSONL file")
+    parser.add_argument("--all-tools", action="store_true", help="Send every tool schema with each request instead of routing")
     args = parser.parse_args()
-    main(args.module)
\ No newline at end of file
+    main(args.module, stream=not args.no_stream, scenario_mode=args.scenario_mode, metrics_path=args.metrics,
+         route_tools=not args.all_tools)
\ No newline at end of file
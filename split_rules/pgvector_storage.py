@@ -1,15 +1,20 @@
 import os
-import psycopg2
 from psycopg2.extras import execute_values
-import numpy as np
 import PyPDF2
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import sys
+from argparse import ArgumentParser
 from pathlib import Path
 
 # Add src to path to import embeddings
 sys.path.append(str(Path(__file__).parent.parent))
 from src.embeddings import EmbeddingManager
+from src.embedding_postprocess import fit_pca, default_pca_path
+from src.vector_store import (
+    RULE_CHUNKS_TABLE, INDEX_TYPES, build_vector_index, create_rule_chunks_table, document_key, drop_vector_index,
+    set_search_params, vector_literal
+)
+from src.db_pool import get_pool
 
 class PGVectorStorage:
     def __init__(
@@ -20,7 +25,11 @@ class PGVectorStorage:
         user: str = "coc",
         password: str = "coc_rule",
         embedding_model: str = "all-mpnet-base-v2",
-        chunk_size: int = 500
+        chunk_size: int = 500,
+        processes: Optional[int] = None,
+        index_type: Optional[str] = None,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None
     ):
         """Initialize connection to PostgreSQL with pgvector extension.
         
@@ -32,6 +41,10 @@ class PGVectorStorage:
             password: Database password
             embedding_model: Model name for sentence embeddings
             chunk_size: Number of characters per text chunk
+            processes: Worker processes used to embed documents (default: EMBEDDING_PROCESSES)
+            index_type: Vector index, "ivfflat" or "hnsw" (default: VECTOR_INDEX_TYPE, then "ivfflat")
+            probes: ivfflat lists searched per query (default: VECTOR_PROBES, then 10)
+            ef_search: hnsw candidate list size per query (default: VECTOR_EF_SEARCH, then 40)
         """
         self.connection_params = {
             "host": host,
@@ -41,8 +54,15 @@ class PGVectorStorage:
             "password": password
         }
         self.chunk_size = chunk_size
+        self.processes = processes
+        self.index_type = index_type or os.getenv("VECTOR_INDEX_TYPE", "ivfflat")
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported vector index type: {self.index_type}")
+        self.probes = probes or int(os.getenv("VECTOR_PROBES", "10"))
+        self.ef_search = ef_search or int(os.getenv("VECTOR_EF_SEARCH", "40"))
         self.embedding_manager = EmbeddingManager(model_name=embedding_model)
         self.vector_dim = self.embedding_manager.dimension
+        self.vector_type = self.embedding_manager.postprocessor.vector_type
         
         # Initialize database
         self._initialize_db()
@@ -65,43 +85,57 @@ class PGVectorStorage:
             conn.close()
 
     def _get_connection(self):
-        """Get a connection to the PostgreSQL database."""
-        return psycopg2.connect(**self.connection_params)
+        """Borrow a connection from the shared pool; `close()` returns it."""
+        return get_pool(**self.connection_params).getconn()
     
-    def create_table_for_document(self, document_name: str) -> None:
-        """Create a table for a specific document if it doesn't exist.
+    def create_rule_chunks_table(self) -> None:
+        """Create the table holding the chunks of every document, if it doesn't exist."""
+        conn = self._get_connection()
+        try:
+            with conn.cursor() as cursor:
+                create_rule_chunks_table(cursor, self.vector_dim, self.vector_type)
+                conn.commit()
+                print(f"Created table {RULE_CHUNKS_TABLE}")
+        finally:
+            conn.close()
+    
+    def drop_index(self) -> None:
+        """Drop the vector index before a bulk load; `build_index` builds it again afterwards."""
+        conn = self._get_connection()
+        try:
+            with conn.cursor() as cursor:
+                drop_vector_index(cursor)
+                conn.commit()
+        finally:
+            conn.close()
+    
+    def build_index(self, rebuild: bool = False) -> Dict[str, Any]:
+        """Build the vector index sized for the rows now stored.
         
         Args:
-            document_name: Name of the document (will be used as table name)
+            rebuild: Replace an existing index, e.g. after more documents were stored
+            
+        Returns:
+            Report of the build, see `build_vector_index`
         """
-        # Sanitize table name (remove extension and invalid chars)
-        table_name = document_name.split('.')[0].lower().replace('-', '_')
-        
         conn = self._get_connection()
         try:
             with conn.cursor() as cursor:
-                # Create table with vector support
-                cursor.execute(f"""
-                    CREATE TABLE IF NOT EXISTS coc_rules.{table_name} (
-                        id SERIAL PRIMARY KEY,
-                        page INTEGER,
-                        chunk_index INTEGER,
-                        content TEXT NOT NULL,
-                        embedding VECTOR({self.vector_dim}) NOT NULL
-                    );
-                """)
-                
-                # Create vector index
-                cursor.execute(f"""
-                    CREATE INDEX IF NOT EXISTS {table_name}_embedding_idx 
-                    ON coc_rules.{table_name} USING ivfflat (embedding vector_cosine_ops)
-                    WITH (lists = 100);
-                """)
-                
+                report = build_vector_index(cursor, self.vector_type, self.index_type, rebuild)
                 conn.commit()
-                print(f"Created table coc_rules.{table_name}")
         finally:
             conn.close()
+        params = ", ".join(f"{key}={report[key]}" for key in ("lists", "m", "ef_construction") if key in report)
+        if report["previous"] is not None and not rebuild:
+            print(f"Kept the existing {report['previous_type']} index ({', '.join(report['previous'])})")
+            if report["stale"]:
+                print(f"The table has grown to {report['rows']} rows since the index was built; "
+                      f"run `python split_rules/pgvector_storage.py --reindex` to resize it")
+        else:
+            print(f"Built {self.index_type} index on {report['rows']} rows in {report['seconds']}s ({params})"
+                  + (f", replacing the {report['previous_type']} index ({', '.join(report['previous'])})"
+                     if report["previous"] is not None else ""))
+        return report
     
     def extract_text_from_pdf(self, pdf_path: str) -> List[Tuple[int, str]]:
         """Extract text from PDF file with page numbers.
@@ -172,55 +206,66 @@ class PGVectorStorage:
         
         return chunks
     
-    def store_document(self, pdf_path: str) -> None:
+    def store_document(self, pdf_path: str, build_index: bool = True) -> None:
         """Process and store a document in the vector database.
         
         Args:
             pdf_path: Path to the PDF file
+            build_index: Build the vector index afterwards if the table has none;
+                         pass False when storing many documents and call
+                         `build_index` once they are all loaded
         """
         document_name = os.path.basename(pdf_path)
-        table_name = document_name.split('.')[0].lower().replace('-', '_')
+        document = document_key(document_name)
         
-        # Create table for the document
-        self.create_table_for_document(document_name)
+        self.create_rule_chunks_table()
         
         # Extract text from PDF
         page_texts = self.extract_text_from_pdf(pdf_path)
         
-        # Process each page
+        # Chunk every page, then embed the whole document at once so chunks
+        # of similar length from different pages share batches
+        rows = []
         for page_num, text in page_texts:
-            # Chunk the text
-            chunks = self.chunk_text(text)
-            
-            # Create embeddings for chunks
-            if chunks:
-                embeddings = self.embedding_manager.get_embeddings(chunks)
+            for i, chunk in enumerate(self.chunk_text(text)):
+                rows.append((page_num, i, chunk))
+        if not rows:
+            return
+        embeddings = self.embedding_manager.encode_bulk([chunk for _, _, chunk in rows], processes=self.processes)
+        
+        # Store in database
+        conn = self._get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Prepare data for batch insert
+                data = [
+                    (document, page_num, i, chunk, vector_literal(embedding))
+                    for (page_num, i, chunk), embedding in zip(rows, embeddings)
+                ]
+                
+                # Storing a document again replaces its chunks
+                cursor.execute(f"DELETE FROM {RULE_CHUNKS_TABLE} WHERE document = %s", (document,))
                 
-                # Store in database
-                conn = self._get_connection()
-                try:
-                    with conn.cursor() as cursor:
-                        # Prepare data for batch insert
-                        data = []
-                        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                            data.append((page_num, i, chunk, embedding.tolist()))
-                        
-                        # Batch insert
-                        execute_values(
-                            cursor,
-                            f"""
-                            INSERT INTO coc_rules.{table_name} 
-                            (page, chunk_index, content, embedding) 
-                            VALUES %s
-                            """,
-                            data,
-                            template="(%s, %s, %s, %s)"
-                        )
-                        
-                        conn.commit()
-                    print(f"Stored {len(chunks)} chunks from page {page_num} of {document_name}")
-                finally:
-                    conn.close()
+                # Batch insert
+                execute_values(
+                    cursor,
+                    f"""
+                    INSERT INTO {RULE_CHUNKS_TABLE} 
+                    (document, page, chunk_index, content, embedding) 
+                    VALUES %s
+                    """,
+                    data,
+                    template=f"(%s, %s, %s, %s, %s::{self.vector_type})",
+                    page_size=500
+                )
+                
+                conn.commit()
+            print(f"Stored {len(rows)} chunks from {len(page_texts)} pages of {document_name}")
+        finally:
+            conn.close()
+        
+        if build_index:
+            self.build_index()
     
     def search_document(self, document_name: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Search for similar content in a specific document.
@@ -233,18 +278,20 @@ class PGVectorStorage:
         Returns:
             List of dictionaries with page, content, and similarity score
         """
-        table_name = document_name.split('.')[0].lower().replace('-', '_')
         query_embedding = self.embedding_manager.get_embedding(query)
         
         conn = self._get_connection()
         try:
             with conn.cursor() as cursor:
+                set_search_params(cursor, self.index_type, self.probes, self.ef_search, filtered=True)
+                query_vector = vector_literal(query_embedding)
                 cursor.execute(f"""
-                    SELECT page, content, 1 - (embedding <=> %s) AS similarity
-                    FROM coc_rules.{table_name}
-                    ORDER BY similarity DESC
+                    SELECT page, content, -(embedding <#> %s::{self.vector_type}) AS similarity
+                    FROM {RULE_CHUNKS_TABLE}
+                    WHERE document = %s
+                    ORDER BY embedding <#> %s::{self.vector_type}
                     LIMIT %s
-                """, (query_embedding.tolist(), limit))
+                """, (query_vector, document_key(document_name), query_vector, limit))
                 
                 results = []
                 for page, content, similarity in cursor.fetchall():
@@ -254,7 +301,8 @@ class PGVectorStorage:
                         "similarity": similarity
                     })
                 
-                return results
+                # Iterative ivfflat scans return rows in relaxed order
+                return sorted(results, key=lambda r: r["similarity"], reverse=True)
         finally:
             conn.close()
     
@@ -274,59 +322,198 @@ class PGVectorStorage:
         conn = self._get_connection()
         try:
             with conn.cursor() as cursor:
-                # Get all tables in our schema
-                cursor.execute("""
-                    SELECT table_name 
-                    FROM information_schema.tables
-                    WHERE table_schema = 'coc_rules'
-                """)
-                
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                # Search each table
-                for table in tables:
-                    cursor.execute(f"""
-                        SELECT page, content, 1 - (embedding <=> %s) AS similarity
-                        FROM coc_rules.{table}
-                        ORDER BY similarity DESC
+                # Each LATERAL subquery filters on its document
+                set_search_params(cursor, self.index_type, self.probes, self.ef_search, filtered=True)
+                query_vector = vector_literal(query_embedding)
+                # The top chunks of every document, in one query
+                cursor.execute(f"""
+                    SELECT documents.document, hits.page, hits.content, hits.similarity
+                    FROM (SELECT DISTINCT document FROM {RULE_CHUNKS_TABLE}) AS documents
+                    CROSS JOIN LATERAL (
+                        SELECT page, content, -(embedding <#> %s::{self.vector_type}) AS similarity
+                        FROM {RULE_CHUNKS_TABLE}
+                        WHERE document = documents.document
+                        ORDER BY embedding <#> %s::{self.vector_type}
                         LIMIT %s
-                    """, (query_embedding.tolist(), limit))
-                    
-                    doc_results = []
-                    for page, content, similarity in cursor.fetchall():
-                        doc_results.append({
-                            "page": page,
-                            "content": content,
-                            "similarity": similarity
-                        })
-                    
-                    if doc_results:
-                        # Convert snake_case back to original filename
-                        doc_name = f"{table}.pdf"
-                        results[doc_name] = doc_results
+                    ) AS hits
+                    ORDER BY documents.document, hits.similarity DESC
+                """, (query_vector, query_vector, limit))
+                
+                for document, page, content, similarity in cursor.fetchall():
+                    # Convert snake_case back to original filename
+                    results.setdefault(f"{document}.pdf", []).append({
+                        "page": page,
+                        "content": content,
+                        "similarity": similarity
+                    })
                 
                 return results
         finally:
             conn.close()
 
 
-def process_all_pdfs(directory: str):
+def fit_projection(directory: str, output_dim: int, processes: Optional[int] = None) -> str:
+    """Fit the PCA projection of the embeddings on the chunks of all PDF files in a directory.
+
+    Args:
+        directory: Path to the directory containing PDF files
+        output_dim: Dimension to reduce the embeddings to
+        processes: Worker processes used to embed the chunks
+
+    Returns:
+        Path of the saved projection, picked up by `EmbeddingPostprocessor.from_env`
+        once EMBEDDING_DIM is set to `output_dim`
+    """
+    storage = PGVectorStorage(processes=processes)
+    chunks = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.pdf'):
+            for _, text in storage.extract_text_from_pdf(os.path.join(directory, filename)):
+                chunks.extend(storage.chunk_text(text))
+    print(f"Fitting PCA to {output_dim} dimensions on {len(chunks)} chunks...")
+    embeddings = storage.embedding_manager.encode_bulk(chunks, raw=True)
+    path = default_pca_path(storage.embedding_manager.model_name, output_dim)
+    fit_pca(embeddings, output_dim).save(path)
+    return path
+
+
+def migrate_per_document_tables(drop_old: bool = False, processes: Optional[int] = None,
+                                copy_embeddings: bool = False) -> None:
+    """Copy the chunks of the old per-document tables (`coc_rules.<document>`) into `coc_rules.rule_chunks`.
+
+    The chunks are embedded again with the configured model. The old tables
+    don't record which model embedded them, so their vectors are only reused
+    (normalized and cast in SQL) with `copy_embeddings`, and only if the
+    dimension matches. Each document is copied in its own transaction and
+    replaces any rows it already has in the new table; a document that fails
+    is rolled back and reported, and the others are still copied.
+
+    Args:
+        drop_old: Drop each old table once its chunks are copied
+        processes: Worker processes used to embed the chunks
+        copy_embeddings: The old tables were embedded with the configured
+                         model, copy their vectors instead of embedding again
+    """
+    storage = PGVectorStorage(processes=processes)
+    storage.create_rule_chunks_table()
+    # Load without the index, then build it on the copied rows
+    storage.drop_index()
+    
+    conn = storage._get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT table_name
+                FROM information_schema.tables
+                WHERE table_schema = 'coc_rules' AND table_name <> 'rule_chunks'
+                ORDER BY table_name
+            """)
+            tables = [row[0] for row in cursor.fetchall()]
+        
+        failed = []
+        for table in tables:
+            try:
+                count = _migrate_table(storage, conn, table, drop_old, copy_embeddings)
+            except Exception as e:
+                # Leave the aborted transaction so the next table can go on
+                conn.rollback()
+                failed.append(table)
+                print(f"Failed to migrate {table}: {e}")
+                continue
+            print(f"Migrated {count} chunks of {table}" + (" and dropped its table" if drop_old else ""))
+        if failed:
+            print(f"Not migrated: {', '.join(failed)}; fix the error and run --migrate again")
+    finally:
+        conn.close()
+    storage.build_index()
+
+
+def _migrate_table(storage: PGVectorStorage, conn, table: str, drop_old: bool, copy_embeddings: bool) -> int:
+    """Copy one old table in one transaction; returns the number of chunks copied."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT vector_dims(embedding) FROM coc_rules.{table} LIMIT 1")
+        row = cursor.fetchone()
+        if copy_embeddings and row and row[0] != storage.vector_dim:
+            print(f"{table} has {row[0]}-d embeddings, the model {storage.vector_dim}-d: embedding it again")
+        cursor.execute(f"DELETE FROM {RULE_CHUNKS_TABLE} WHERE document = %s", (table,))
+        if copy_embeddings and row and row[0] == storage.vector_dim:
+            cursor.execute(f"""
+                INSERT INTO {RULE_CHUNKS_TABLE} (document, page, chunk_index, content, embedding)
+                SELECT %s, page, chunk_index, content, l2_normalize(embedding)::{storage.vector_type}
+                FROM coc_rules.{table}
+            """, (table,))
+            count = cursor.rowcount
+        else:
+            cursor.execute(f"SELECT page, chunk_index, content FROM coc_rules.{table} ORDER BY page, chunk_index")
+            rows = cursor.fetchall()
+            embeddings = storage.embedding_manager.encode_bulk([content for _, _, content in rows])
+            execute_values(
+                cursor,
+                f"""
+                INSERT INTO {RULE_CHUNKS_TABLE} 
+                (document, page, chunk_index, content, embedding) 
+                VALUES %s
+                """,
+                [(table, page, i, content, vector_literal(embedding))
+                 for (page, i, content), embedding in zip(rows, embeddings)],
+                template=f"(%s, %s, %s, %s, %s::{storage.vector_type})",
+                page_size=500
+            )
+            count = len(rows)
+        if drop_old:
+            cursor.execute(f"DROP TABLE coc_rules.{table}")
+        conn.commit()
+    return count
+
+
+def process_all_pdfs(directory: str, processes: Optional[int] = None):
     """Process all PDF files in a directory and store them in pgvector.
     
     Args:
         directory: Path to the directory containing PDF files
+        processes: Worker processes used to embed the documents
     """
-    storage = PGVectorStorage()
+    storage = PGVectorStorage(processes=processes)
+    storage.create_rule_chunks_table()
+    # Inserting into an index trained on other rows is slow and leaves its
+    # lists unbalanced: load without it, then build it on the full table
+    storage.drop_index()
     
     # Process all PDF files
     for filename in os.listdir(directory):
         if filename.endswith('.pdf'):
             pdf_path = os.path.join(directory, filename)
             print(f"Processing {filename}...")
-            storage.store_document(pdf_path)
+            storage.store_document(pdf_path, build_index=False)
+    
+    storage.build_index()
 
 
 if __name__ == "__main__":
-    # Get the directory from the first argument or use the current directory
-    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(__file__)
-    process_all_pdfs(directory)
+    parser = ArgumentParser(description="Store the rule PDFs in pgvector")
+    # Defaults to the directory of this script
+    parser.add_argument("directory", nargs="?", default=os.path.dirname(__file__))
+    parser.add_argument("--fit-pca", type=int, default=None, metavar="DIM",
+                        help="Fit a PCA projection to DIM dimensions on the PDFs instead of storing them")
+    parser.add_argument("--migrate", action="store_true",
+                        help="Copy the old per-document tables into coc_rules.rule_chunks instead of storing PDFs")
+    parser.add_argument("--drop-old", action="store_true", help="With --migrate, drop each old table once copied")
+    parser.add_argument("--copy-embeddings", action="store_true",
+                        help="With --migrate, reuse the old vectors instead of embedding again; "
+                             "only if they come from the configured model")
+    parser.add_argument("--reindex", action="store_true",
+                        help="Rebuild the vector index sized for the current number of chunks instead of storing PDFs")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Embed with this many worker processes (default: EMBEDDING_PROCESSES or 1)")
+    args = parser.parse_args()
+    if args.reindex:
+        PGVectorStorage().build_index(rebuild=True)
+    elif args.migrate:
+        migrate_per_document_tables(args.drop_old, args.processes, args.copy_embeddings)
+    elif args.fit_pca:
+        # The projection is fitted on raw embeddings, whatever EMBEDDING_DIM says
+        os.environ.pop("EMBEDDING_DIM", None)
+        path = fit_projection(args.directory, args.fit_pca, args.processes)
+        print(f"Saved the projection to {path}; set EMBEDDING_DIM={args.fit_pca} and store the documents again.")
+    else:
+        process_all_pdfs(args.directory, args.processes)
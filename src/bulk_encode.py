@@ -0,0 +1,91 @@
+import os
+import logging
+import multiprocessing
+from typing import Callable, List, Optional
+import numpy as np
+from .history import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def length_buckets(lengths: List[int], max_tokens: int = 8192, max_batch: int = 128) -> List[List[int]]:
+    """Group text indices into batches of similar length.
+
+    Indices are sorted by length, longest first, and cut into batches whose
+    padded size (batch size x longest text) stays within `max_tokens`, so
+    short texts are not padded to the length of long ones.
+
+    Args:
+        lengths: Estimated token count of each text
+        max_tokens: Padded token budget of one batch
+        max_batch: Largest number of texts in one batch
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for i in order:
+        # The first text of a batch is its longest one
+        longest = lengths[current[0]] if current else lengths[i]
+        if current and (len(current) >= max_batch or (len(current) + 1) * max(longest, 1) > max_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Model of a pool worker, loaded once by `_init_worker`
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, threads: int) -> None:
+    global _worker_model
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["EMBEDDING_CACHE"] = "off"
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+    from .embeddings import get_model
+    _worker_model = get_model(model_name, "cpu", backend)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=len(texts))
+
+
+def bulk_encode(encode: Callable[..., np.ndarray], texts: List[str], dimension: int,
+                max_tokens: int = 8192, max_batch: int = 128, processes: int = 1,
+                model_name: Optional[str] = None, backend: str = "torch") -> np.ndarray:
+    """Encode many texts in length-bucketed batches, returned in input order.
+
+    Args:
+        encode: Encodes a list of texts in the current process (`SharedModel.encode`)
+        texts: Texts to encode
+        dimension: Embedding dimension, for the empty result
+        max_tokens: Padded token budget of one batch, see `length_buckets`
+        max_batch: Largest number of texts in one batch
+        processes: Worker processes; above 1, batches are spread over a pool in
+                   which every worker loads its own copy of the model
+        model_name: Model the workers load (needed when `processes` > 1)
+        backend: Backend the workers load the model with
+    """
+    if not texts:
+        return np.empty((0, dimension), dtype=np.float32)
+    batches = length_buckets([count_tokens(text) for text in texts], max_tokens, max_batch)
+    logger.info(f"Encoding {len(texts)} texts in {len(batches)} batches on {processes} process(es)")
+
+    batch_texts = [[texts[i] for i in batch] for batch in batches]
+    if processes > 1 and len(batches) > 1:
+        threads = max(1, (os.cpu_count() or processes) // processes)
+        # spawn: forking a process that already loaded torch can deadlock
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes, initializer=_init_worker, initargs=(model_name, backend, threads)) as pool:
+            results = pool.map(_encode_in_worker, batch_texts, chunksize=1)
+    else:
+        results = [encode(chunk, batch_size=len(chunk)) for chunk in batch_texts]
+
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
+    for batch, result in zip(batches, results):
+        embeddings[batch] = result
+    return embeddings
@@ -0,0 +1,169 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionChunk
+
+logger = logging.getLogger(__name__)
+
+# Request fields that decide what the model answers; transport options such
+# as `timeout` are left out of the key on purpose.
+KEY_FIELDS = ["model", "messages", "tools", "tool_choice", "temperature", "stream"]
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def _normalize(value: Any) -> Any:
+    """Turn messages (dicts or openai models) into plain JSON data without None values."""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(exclude_none=True)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class Cassette:
+    """Record/replay store for chat completions.
+
+    Every request is keyed by a SHA-256 hash of its normalized JSON form and
+    stored with its response in a JSONL file. Modes:
+    - "off": always go to the network
+    - "record": replay recorded requests, fall through to the network and
+      record everything else
+    - "replay": only replay, a request that was never recorded raises
+      `CassetteMiss`
+    Identical requests recorded several times are replayed in order.
+    """
+
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, path: str = "cassettes/llm.jsonl", mode: str = OFF):
+        if mode not in (self.OFF, self.RECORD, self.REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if mode != self.OFF and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def from_env(cls, session: Optional[str] = None) -> "Cassette":
+        """Build a cassette from LLM_CASSETTE_MODE / LLM_CASSETTE_PATH.
+
+        Args:
+            session: Record to a file of its own, next to LLM_CASSETTE_PATH
+                     (cassettes/llm.<session>.jsonl); concurrent sessions must
+                     not append to the same file
+        """
+        path = os.getenv("LLM_CASSETTE_PATH", "cassettes/llm.jsonl")
+        if session:
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{session}{ext}"
+        return cls(path=path, mode=os.getenv("LLM_CASSETTE_MODE", cls.OFF).lower())
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+        logger.info(f"Loaded {sum(len(e) for e in self._entries.values())} recorded completions from {self.path}")
+
+    @staticmethod
+    def request_key(request: Dict[str, Any]) -> str:
+        """Stable hash of the fields of a request that affect the response.
+
+        Tool results are reduced to their `tool_call_id`: dice rolls and
+        database contents differ between runs, and the replay should still
+        follow the recorded conversation.
+        """
+        normalized = {field: _normalize(request.get(field)) for field in KEY_FIELDS}
+        normalized["messages"] = [
+            {"role": "tool", "tool_call_id": m.get("tool_call_id")} if m.get("role") == "tool" else m
+            for m in normalized["messages"] or []
+        ]
+        payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _next_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(key, [])
+            cursor = self._cursors.get(key, 0)
+            if cursor >= len(entries):
+                return None
+            self._cursors[key] = cursor + 1
+            return entries[cursor]
+
+    def _append(self, key: str, request: Dict[str, Any], **recorded) -> None:
+        entry = {"key": key, "request": {f: _normalize(request.get(f)) for f in KEY_FIELDS}, **recorded}
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            # Recorded entries are consumed right away so a repeat of the
+            # same request in this session records a new take.
+            self._cursors[key] = len(self._entries[key])
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _replay(self, entry: Dict[str, Any]):
+        if "chunks" in entry:
+            from openai.types.chat import ChatCompletionChunk
+            return iter([ChatCompletionChunk.model_validate(chunk) for chunk in entry["chunks"]])
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate(entry["response"])
+
+    def _lookup(self, key: str):
+        entry = self._next_entry(key)
+        if entry is not None:
+            return self._replay(entry)
+        if self.mode == self.REPLAY:
+            raise CassetteMiss(f"No recorded completion for request {key[:12]}")
+        return None
+
+    def _record_stream(self, key: str, request: Dict[str, Any], stream) -> Iterator["ChatCompletionChunk"]:
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk.model_dump())
+            yield chunk
+        # Only complete streams are worth replaying
+        self._append(key, request, chunks=chunks)
+
+    def create(self, create_fn: Callable, **request):
+        """Serve `create_fn(**request)` from the cassette when possible."""
+        if self.mode == self.OFF:
+            return create_fn(**request)
+        key = self.request_key(request)
+        replayed = self._lookup(key)
+        if replayed is not None:
+            return replayed
+        response = create_fn(**request)
+        if request.get("stream"):
+            return self._record_stream(key, request, response)
+        self._append(key, request, response=response.model_dump())
+        return response
+
+    async def acreate(self, create_fn: Callable, **request):
+        """Async counterpart of `create` for non-streaming requests."""
+        if self.mode == self.OFF:
+            return await create_fn(**request)
+        key = self.request_key(request)
+        replayed = self._lookup(key)
+        if replayed is not None:
+            return replayed
+        response = await create_fn(**request)
+        self._append(key, request, response=response.model_dump())
+        return response
@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from .metrics import timed, record_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the acquisition timeout."""
+
+
+class PooledConnection:
+    """A pooled psycopg2 connection; `close()` hands it back to the pool.
+
+    Everything else is delegated to the underlying connection, so code written
+    for `psycopg2.connect` (`try: ... finally: conn.close()`) works unchanged.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn):
+        self._pool = pool
+        self._conn = conn
+        self._returned = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        if not self._returned:
+            self._returned = True
+            self._pool.putconn(self._conn)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """Thread-safe PostgreSQL connection pool.
+
+    Connections are opened on demand, up to `maxconn`, and every returned
+    connection is kept open for reuse; `minconn` are opened up front. Callers
+    wait up to `timeout` seconds for a free connection when all are in use.
+    Connections idle for longer than `health_check_after` seconds are
+    checked with `SELECT 1` before they are handed out, and replaced if the
+    check fails.
+    """
+
+    def __init__(self, minconn: int = 1, maxconn: int = 10, timeout: float = 5.0,
+                 health_check_after: float = 30.0, **connection_params):
+        """Open the pool.
+
+        Args:
+            minconn: Connections opened up front
+            maxconn: Upper bound on open connections
+            timeout: Seconds to wait for a free connection before raising `PoolTimeout`
+            health_check_after: Idle seconds after which a connection is checked before use
+            connection_params: Arguments of `psycopg2.connect`
+        """
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.connection_params = connection_params
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # Idle connections and when they were returned, most recent last
+        self._idle: List[Tuple[Any, float]] = []
+        self._open = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.replaced = 0
+        for _ in range(min(minconn, maxconn)):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(**self.connection_params)
+        with self._lock:
+            self._open += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        with self._lock:
+            self._open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self) -> PooledConnection:
+        """Borrow a connection; call `close()` on it (or use it as a context manager) to return it."""
+        start = time.perf_counter()
+        with timed("db_pool_wait"):
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeout(f"No database connection free within {self.timeout}s")
+            try:
+                conn = self._healthy_connection()
+            except Exception:
+                self._slots.release()
+                raise
+        with self._lock:
+            self.acquisitions += 1
+            self.wait_seconds += time.perf_counter() - start
+        record_db_pool(self.size)
+        return PooledConnection(self, conn)
+
+    def _healthy_connection(self):
+        with self._lock:
+            conn, returned_at = self._idle.pop() if self._idle else (None, 0.0)
+        if conn is None:
+            return self._connect()
+        if conn.closed or time.monotonic() - returned_at > self.health_check_after:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Replacing broken database connection: {e}")
+                self._discard(conn)
+                with self._lock:
+                    self.replaced += 1
+                return self._connect()
+        return conn
+
+    def putconn(self, conn) -> None:
+        """Return a connection, rolling back whatever transaction it left open."""
+        try:
+            healthy = not conn.closed and not self._closed
+            if healthy:
+                try:
+                    conn.rollback()
+                except Exception:
+                    healthy = False
+            if healthy:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @property
+    def size(self) -> int:
+        """Open connections, in use or idle."""
+        return self._open
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self._open,
+                "in_use": self._open - len(self._idle),
+                "max": self.maxconn,
+                "acquisitions": self.acquisitions,
+                "wait_seconds_avg": round(self.wait_seconds / self.acquisitions, 6) if self.acquisitions else 0.0,
+                "timeouts": self.timeouts,
+                "replaced": self.replaced,
+            }
+
+    def closeall(self) -> None:
+        """Close the idle connections; borrowed ones are closed when returned."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pools: Dict[Tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(minconn: Optional[int] = None, maxconn: Optional[int] = None, timeout: Optional[float] = None,
+             **connection_params) -> ConnectionPool:
+    """Return the process-wide pool for these connection parameters, opening it on first use.
+
+    Sizes and timeout default to DB_POOL_MIN, DB_POOL_MAX and DB_POOL_TIMEOUT.
+    """
+    key = tuple(sorted(connection_params.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                minconn=minconn or int(os.getenv("DB_POOL_MIN", "1")),
+                maxconn=maxconn or int(os.getenv("DB_POOL_MAX", "10")),
+                timeout=timeout or float(os.getenv("DB_POOL_TIMEOUT", "5")),
+                **connection_params,
+            )
+        return _pools[key]
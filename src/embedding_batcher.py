@@ -0,0 +1,102 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into model batches.
+
+    A background thread takes the first pending request, waits up to
+    `max_wait_ms` for more (or until `max_batch` are queued), encodes them in
+    one call and resolves each caller's future.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch: int = 32, max_wait_ms: float = 5.0):
+        """Initialize the batcher and start its worker thread.
+
+        Args:
+            encode_fn: Encodes a list of texts into a (len(texts), dimension) array
+            max_batch: Largest batch handed to `encode_fn`
+            max_wait_ms: Longest a request waits for others to join its batch
+        """
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> "Future[np.ndarray]":
+        """Queue a text; the future resolves to its embedding."""
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher is closed")
+        future: "Future[np.ndarray]" = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Embed one text, blocking until its batch has run."""
+        return self.submit(text).result(timeout)
+
+    async def aembed(self, text: str) -> np.ndarray:
+        """Embed one text without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self, first: Tuple[str, Future]) -> List[Tuple[str, Future]]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Close requested: finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [(text, future) for text, future in self._collect(first) if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.encode_fn([text for text, _ in batch])
+            except Exception as e:
+                logger.warning(f"Embedding batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+    def close(self) -> None:
+        """Stop the worker after the requests already queued are served."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import atexit
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a text for caching: NFKC, collapsed whitespace, stripped."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """Content address of the embedding of `text` under `model_name`."""
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class DiskTier:
+    """Embeddings stored in a memory-mapped float32 array plus a JSON index.
+
+    The index maps each key to its row in the array and the logical time it
+    was last used. When the array reaches `max_bytes`, the least recently used
+    rows are reused; the index is saved before an evicted row is overwritten,
+    so a crash can lose recent entries but never map a key to another text's
+    vector.
+
+    Every flush rewrites the whole index file, and nothing locks the files:
+    a cache directory must be used by one process at a time (worker
+    processes run with EMBEDDING_CACHE=off).
+    """
+
+    def __init__(self, directory: str, name: str, dimension: int, max_bytes: int,
+                 initial_rows: int = 1024, flush_every: int = 256, evict_fraction: float = 0.1):
+        """Open (or create) the disk tier.
+
+        Args:
+            directory: Folder holding the array and index files
+            name: File name stem, one per model
+            dimension: Embedding dimension
+            max_bytes: Upper bound on the size of the array file
+            initial_rows: Rows allocated when the file is created; it doubles as needed
+            flush_every: Writes between index flushes
+            evict_fraction: Share of the rows freed at once when the array is full
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, f"{name}.f32")
+        self.index_path = os.path.join(directory, f"{name}.index.json")
+        self.dimension = dimension
+        self.max_rows = max(1, max_bytes // (dimension * 4))
+        self.flush_every = flush_every
+        self.evict_fraction = evict_fraction
+        self.index: Dict[str, List[int]] = {}  # key -> [row, last_used]
+        self.free_rows: List[int] = []
+        self.clock = 0
+        self._dirty = 0
+
+        rows = min(initial_rows, self.max_rows)
+        if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("dimension") == dimension:
+                self.index = saved["index"]
+                self.clock = saved["clock"]
+                rows = max(saved["rows"], 1)
+            else:
+                logger.warning(f"Ignoring embedding cache {self.data_path}: dimension changed")
+        self.rows = 0
+        self.array = self._open(rows, fresh=not self.index)
+        used = {row for row, _ in self.index.values()}
+        self.free_rows = [row for row in range(self.rows) if row not in used]
+
+    def _open(self, rows: int, fresh: bool = False) -> np.memmap:
+        mode = "w+" if fresh or not os.path.exists(self.data_path) else "r+"
+        array = np.memmap(self.data_path, dtype=np.float32, mode=mode, shape=(rows, self.dimension))
+        self.free_rows.extend(range(self.rows, rows))
+        self.rows = rows
+        return array
+
+    def _grow_or_evict(self) -> None:
+        if self.rows < self.max_rows:
+            self.array.flush()
+            del self.array
+            self.array = self._open(min(self.rows * 2, self.max_rows))
+            return
+        count = max(1, int(len(self.index) * self.evict_fraction))
+        oldest = sorted(self.index.items(), key=lambda item: item[1][1])[:count]
+        for key, (row, _) in oldest:
+            del self.index[key]
+            self.free_rows.append(row)
+        # The saved index must stop pointing at these rows before they are reused
+        self._dirty += 1
+        self.flush()
+        logger.debug(f"Evicted {count} embeddings from {self.data_path}")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        self.clock += 1
+        entry[1] = self.clock
+        return np.array(self.array[entry[0]])
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        entry = self.index.get(key)
+        if entry is None:
+            if not self.free_rows:
+                self._grow_or_evict()
+            entry = self.index[key] = [self.free_rows.pop(), 0]
+        self.clock += 1
+        entry[1] = self.clock
+        self.array[entry[0]] = vector
+        self._dirty += 1
+        if self._dirty >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        self.array.flush()
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dimension": self.dimension, "rows": self.rows, "clock": self.clock, "index": self.index}, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = 0
+
+
+class EmbeddingCache:
+    """Two-tier cache of embeddings keyed by (model name, normalized text hash).
+
+    Lookups go to an in-memory LRU first, then to the disk tier; disk hits are
+    promoted to memory.
+    """
+
+    def __init__(self, model_name: str, dimension: int, directory: Optional[str] = "cache/embeddings",
+                 memory_items: int = 4096, max_disk_mb: int = 512):
+        """Initialize the cache.
+
+        Args:
+            model_name: Model the embeddings come from, part of every key
+            dimension: Embedding dimension
+            directory: Folder of the disk tier; None keeps the cache in memory only
+            memory_items: Capacity of the in-memory LRU
+            max_disk_mb: Size bound of the disk tier's array file
+        """
+        self.model_name = model_name
+        self.memory_items = memory_items
+        self.memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.disk = None
+        if directory:
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+            self.disk = DiskTier(directory, name, dimension, max_disk_mb * 1024 * 1024)
+            atexit.register(self.flush)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, model_name: str, dimension: int) -> Optional["EmbeddingCache"]:
+        """Build the cache from EMBEDDING_CACHE ("off" disables it), EMBEDDING_CACHE_DIR
+        and EMBEDDING_CACHE_MB."""
+        if os.getenv("EMBEDDING_CACHE", "on").lower() == "off":
+            return None
+        return cls(
+            model_name,
+            dimension,
+            directory=os.getenv("EMBEDDING_CACHE_DIR", "cache/embeddings") or None,
+            max_disk_mb=int(os.getenv("EMBEDDING_CACHE_MB", "512")),
+        )
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[str]]:
+        """Look up texts; returns the cached vectors (None on miss) and their keys."""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for key in keys:
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                elif self.disk is not None and (vector := self.disk.get(key)) is not None:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+                vectors.append(vector)
+        return vectors, keys
+
+    def put_many(self, keys: List[str], vectors: np.ndarray) -> None:
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                if self.disk is not None:
+                    self.disk.put(key, vector)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self.disk is not None:
+                self.disk.flush()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit counts and rates since the cache was created."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_items": len(self.memory),
+            "disk_items": len(self.disk.index) if self.disk is not None else 0,
+        }
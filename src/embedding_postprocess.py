@@ -0,0 +1,113 @@
+import os
+import logging
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+REDUCTIONS = ("pca", "truncate")
+DTYPES = {"float16": np.float16, "float32": np.float32}
+
+
+def l2_normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length, so inner product equals cosine similarity."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+def fit_pca(embeddings: np.ndarray, output_dim: int) -> "EmbeddingPostprocessor":
+    """Fit a PCA projection to `output_dim` dimensions on a corpus of raw embeddings."""
+    embeddings = l2_normalize(embeddings)
+    if output_dim > min(embeddings.shape):
+        raise ValueError(f"Cannot fit {output_dim} components on {embeddings.shape[0]} x {embeddings.shape[1]} embeddings")
+    mean = embeddings.mean(axis=0)
+    _, singular_values, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+    explained = (singular_values[:output_dim] ** 2).sum() / (singular_values ** 2).sum()
+    logger.info(f"PCA to {output_dim} dimensions keeps {explained:.1%} of the variance")
+    return EmbeddingPostprocessor(output_dim=output_dim, reduction="pca", mean=mean, components=vt[:output_dim])
+
+
+class EmbeddingPostprocessor:
+    """Turns raw model embeddings into the vectors the stores index.
+
+    Embeddings are L2-normalized, optionally reduced to `output_dim`
+    dimensions (by a PCA projection fitted on the rules corpus, or by
+    keeping the leading dimensions of Matryoshka-trained models), normalized
+    again and cast to `dtype`.
+    """
+
+    def __init__(self, output_dim: Optional[int] = None, reduction: str = "pca", dtype: str = "float16",
+                 mean: Optional[np.ndarray] = None, components: Optional[np.ndarray] = None):
+        """Initialize the postprocessor.
+
+        Args:
+            output_dim: Dimension after reduction; None keeps the model's dimension
+            reduction: "pca" (needs `mean` and `components`, see `fit_pca`) or "truncate"
+            dtype: "float16" or "float32"
+            mean: PCA mean of the normalized corpus embeddings
+            components: PCA components, shape (output_dim, model dimension)
+        """
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction: {reduction}")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        if output_dim and reduction == "pca" and components is None:
+            raise ValueError("PCA reduction needs a fitted projection, see fit_pca")
+        self.output_dim = output_dim
+        self.reduction = reduction
+        self.dtype = dtype
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+
+    @classmethod
+    def from_env(cls, model_name: str) -> "EmbeddingPostprocessor":
+        """Build the postprocessor from EMBEDDING_DIM, EMBEDDING_REDUCTION, EMBEDDING_PCA_PATH
+        and EMBEDDING_DTYPE."""
+        output_dim = int(os.getenv("EMBEDDING_DIM", "0")) or None
+        reduction = os.getenv("EMBEDDING_REDUCTION", "pca").lower()
+        dtype = os.getenv("EMBEDDING_DTYPE", "float16").lower()
+        if output_dim and reduction == "pca":
+            path = os.getenv("EMBEDDING_PCA_PATH") or default_pca_path(model_name, output_dim)
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"No PCA projection at {path}, fit one with `python split_rules/pgvector_storage.py --fit-pca {output_dim}`"
+                )
+            processor = cls.load(path)
+            processor.dtype = dtype
+            return processor
+        return cls(output_dim=output_dim, reduction=reduction, dtype=dtype)
+
+    @property
+    def vector_type(self) -> str:
+        """pgvector column type matching the output dtype."""
+        return "halfvec" if self.dtype == "float16" else "vector"
+
+    def dimension(self, input_dim: int) -> int:
+        """Dimension of the output for a model of dimension `input_dim`."""
+        return self.output_dim or input_dim
+
+    def __call__(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = l2_normalize(embeddings)
+        if self.output_dim:
+            if self.reduction == "pca":
+                embeddings = l2_normalize((embeddings - self.mean) @ self.components.T)
+            else:
+                embeddings = l2_normalize(embeddings[..., :self.output_dim])
+        return embeddings.astype(DTYPES[self.dtype], copy=False)
+
+    def save(self, path: str) -> None:
+        """Save a fitted PCA projection."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingPostprocessor":
+        """Load a PCA projection saved by `save`."""
+        with np.load(path) as data:
+            return cls(output_dim=data["components"].shape[0], reduction="pca",
+                       mean=data["mean"], components=data["components"])
+
+
+def default_pca_path(model_name: str, output_dim: int) -> str:
+    return os.path.join("models", "pca", f"{model_name.replace('/', '_')}-{output_dim}.npz")
@@ -1,11 +1,102 @@
 import os
-from typing import List, Union
+import asyncio
+import threading
+import logging
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from .metrics import timed, record_embedding_cache
+from .embedding_cache import EmbeddingCache
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_postprocess import EmbeddingPostprocessor
+from .bulk_encode import bulk_encode
+
+logger = logging.getLogger(__name__)
+
+
+class SharedModel:
+    """A loaded sentence-transformers model with a lock serializing encode calls."""
+
+    def __init__(self, model):
+        self.model = model
+        self.dimension = model.get_sentence_embedding_dimension()
+        self.lock = threading.Lock()
+
+    def encode(self, texts: Union[str, List[str]], **kwargs) -> np.ndarray:
+        with self.lock:
+            return self.model.encode(texts, convert_to_numpy=True, **kwargs)
+
+
+BACKENDS = ("torch", "onnx")
+
+_models: Dict[Tuple[str, str, str], SharedModel] = {}
+_caches: Dict[str, Optional[EmbeddingCache]] = {}
+_batchers: Dict[int, EmbeddingBatcher] = {}
+_registry_lock = threading.Lock()
+
+
+def get_model(model_name: str, device: Optional[str] = None, backend: Optional[str] = None):
+    """Return the process-wide instance of a model, loading it on first use.
+
+    Args:
+        model_name: Name of the sentence-transformers model
+        device: Torch device such as 'cpu' or 'cuda'; defaults to EMBEDDING_DEVICE,
+                then to whatever sentence-transformers picks
+        backend: "torch" (sentence-transformers) or "onnx" (int8 onnxruntime on CPU,
+                 see `src.onnx_embeddings`); defaults to EMBEDDING_BACKEND, then "torch"
+    """
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "torch").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    device = "cpu" if backend == "onnx" else device or os.getenv("EMBEDDING_DEVICE") or None
+    key = (model_name, device or "auto", backend)
+    with _registry_lock:
+        if key not in _models:
+            logger.info(f"Loading embedding model {model_name} on {key[1]} ({backend})")
+            if backend == "onnx":
+                from .onnx_embeddings import OnnxModel, default_model_dir
+                _models[key] = OnnxModel(default_model_dir(model_name))
+            else:
+                from sentence_transformers import SentenceTransformer
+                _models[key] = SharedModel(SentenceTransformer(model_name, device=device))
+        return _models[key]
+
+
+def get_cache(model_name: str, dimension: int) -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache of a model, or None when caching is off."""
+    with _registry_lock:
+        if model_name not in _caches:
+            _caches[model_name] = EmbeddingCache.from_env(model_name, dimension)
+        return _caches[model_name]
+
+
+def get_batcher(model) -> EmbeddingBatcher:
+    """Return the process-wide request batcher of a loaded model.
+
+    Batch size and wait come from EMBEDDING_BATCH_SIZE and EMBEDDING_BATCH_WAIT_MS.
+    """
+    with _registry_lock:
+        if id(model) not in _batchers:
+            _batchers[id(model)] = EmbeddingBatcher(
+                model.encode,
+                max_batch=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+                max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")),
+            )
+        return _batchers[id(model)]
+
+
+def loaded_models() -> List[Tuple[str, str, str]]:
+    """(model name, device, backend) triples loaded in this process."""
+    with _registry_lock:
+        return list(_models)
+
 
 class EmbeddingManager:
-    def __init__(self, model_name: str = "all-mpnet-base-v2"):
+    def __init__(self, model_name: str = "all-mpnet-base-v2", device: Optional[str] = None,
+                 backend: Optional[str] = None, use_cache: bool = True, batch_requests: bool = True,
+                 postprocessor: Optional[EmbeddingPostprocessor] = None):
         """Initialize the embedding manager with a local Hugging Face model.
+
+        Managers created with the same model name and device share one loaded model.
         
         Args:
             model_name: Name of the sentence-transformers model to use
@@ -14,14 +105,106 @@ class EmbeddingManager:
                        - 'all-MiniLM-L6-v2': Lightweight 384-dim (faster)
                        - 'multi-qa-mpnet-base-dot-v1': 768-dim optimized for retrieval
                        - 'e5-large-v2': High performance 1024-dim (slower)
+            device: Torch device to run the model on, see `get_model`
+            backend: "torch" or "onnx", see `get_model`
+            use_cache: Look texts up in the shared embedding cache before encoding them
+            batch_requests: Send single-text requests through the shared `EmbeddingBatcher`,
+                            so concurrent sessions are encoded together
+            postprocessor: Normalization, dimension reduction and dtype of the returned
+                           embeddings; defaults to `EmbeddingPostprocessor.from_env`
         """
-        self.model = SentenceTransformer(model_name)
-        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.model_name = model_name
+        self.shared = get_model(model_name, device, backend)
+        self.backend = "torch" if isinstance(self.shared, SharedModel) else "onnx"
+        self.raw_dimension = self.shared.dimension
+        self.postprocessor = postprocessor or EmbeddingPostprocessor.from_env(model_name)
+        # Dimension of the embeddings handed to the stores
+        self.dimension = self.postprocessor.dimension(self.raw_dimension)
+        # Quantized embeddings differ slightly, keep them apart from the fp32 ones.
+        # The cache holds raw embeddings, so it survives a change of projection.
+        cache_name = model_name if self.backend == "torch" else f"{model_name}@onnx-int8"
+        self.cache = get_cache(cache_name, self.raw_dimension) if use_cache else None
+        self.batcher = get_batcher(self.shared) if batch_requests else None
         
     def get_embedding(self, text: str) -> np.ndarray:
         """Get embedding for a single text."""
-        return self.model.encode(text, convert_to_numpy=True)
+        return self.get_embeddings([text])[0]
+
+    async def aget_embedding(self, text: str) -> np.ndarray:
+        """Get embedding for a single text without blocking the event loop."""
+        with timed("embedding"):
+            vector, key = self._lookup(text)
+            if vector is None:
+                if self.batcher is not None:
+                    vector = await self.batcher.aembed(text)
+                else:
+                    vector = (await asyncio.get_running_loop().run_in_executor(None, self.shared.encode, [text]))[0]
+                self._store([key], [vector])
+            return self.postprocessor(vector)
         
-    def get_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Get embeddings for multiple texts efficiently in a batch."""
-        return self.model.encode(texts, convert_to_numpy=True) 
\ No newline at end of file
+    def get_embeddings(self, texts: List[str], raw: bool = False) -> np.ndarray:
+        """Get embeddings for multiple texts efficiently in a batch.
+
+        Args:
+            texts: Texts to embed
+            raw: Return the model's embeddings without postprocessing (to fit a projection)
+        """
+        embeddings = self._raw_embeddings(texts)
+        return embeddings if raw else self.postprocessor(embeddings)
+
+    def encode_bulk(self, texts: List[str], raw: bool = False, max_tokens: int = 8192, max_batch: int = 128,
+                    processes: Optional[int] = None) -> np.ndarray:
+        """Embed a large collection of texts (module paragraphs, rule chunks).
+
+        Texts missing from the cache are sorted by length and encoded in
+        token-budgeted batches, optionally spread over worker processes; the
+        result is in input order.
+
+        Args:
+            texts: Texts to embed
+            raw: Return the model's embeddings without postprocessing
+            max_tokens: Padded token budget of one batch
+            max_batch: Largest number of texts in one batch
+            processes: Worker processes, defaults to EMBEDDING_PROCESSES, then 1
+        """
+        processes = processes or int(os.getenv("EMBEDDING_PROCESSES", "1"))
+        encode = lambda missing: bulk_encode(
+            self.shared.encode, missing, self.raw_dimension, max_tokens=max_tokens, max_batch=max_batch,
+            processes=processes, model_name=self.model_name, backend=self.backend
+        )
+        embeddings = self._raw_embeddings(texts, encode)
+        return embeddings if raw else self.postprocessor(embeddings)
+
+    def _raw_embeddings(self, texts: List[str], encode: Optional[Callable[[List[str]], np.ndarray]] = None) -> np.ndarray:
+        encode = encode or self._encode
+        with timed("embedding"):
+            if self.cache is None:
+                return encode(texts)
+            vectors, keys = self.cache.get_many(texts)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            record_embedding_cache(hits=len(texts) - len(missing), misses=len(missing))
+            if missing:
+                encoded = encode([texts[i] for i in missing])
+                self._store([keys[i] for i in missing], encoded)
+                for i, vector in zip(missing, encoded):
+                    vectors[i] = vector
+            if not vectors:
+                return np.empty((0, self.raw_dimension), dtype=np.float32)
+            return np.stack(vectors).astype(np.float32, copy=False)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        # Lone texts are the ones worth coalescing with other sessions' requests
+        if self.batcher is not None and len(texts) == 1:
+            return self.batcher.embed(texts[0])[None, :]
+        return self.shared.encode(texts)
+
+    def _lookup(self, text: str) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        if self.cache is None:
+            return None, None
+        (vector,), (key,) = self.cache.get_many([text])
+        record_embedding_cache(hits=int(vector is not None), misses=int(vector is None))
+        return vector, key
+
+    def _store(self, keys: List[Optional[str]], vectors) -> None:
+        if self.cache is not None:
+            self.cache.put_many(keys, vectors)
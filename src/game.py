@@ -1,42 +1,157 @@
-from typing import List, Dict
+import logging
+from contextlib import contextmanager
+from typing import Any, List, Dict, Iterator, Optional, Tuple
 from .embeddings import EmbeddingManager
 from .vector_store import ModuleStore
 from .llm import LLMManager
+from .cassette import Cassette
+from .history import HistoryManager
+from .metrics import SessionMetrics, current_turn
+from .tool_router import ToolRouter, recent_tool_names
+from .prefetch import RetrievalPrefetcher
+from .component_manager import ComponentManager, get_vector_manager
+
+logger = logging.getLogger(__name__)
 
 class CoCGame:
-    def __init__(self):
+    def __init__(self, history_token_budget: int = 8000, scenario_mode: str = "retrieval", module_top_k: int = 5,
+                 metrics_path: Optional[str] = None, route_tools: bool = True, prefetch_rules: bool = True,
+                 cassette: Optional[Cassette] = None):
+        """Initialize the game.
+
+        Args:
+            history_token_budget: Token budget of the conversation history
+            scenario_mode: "retrieval" puts a module synopsis in the system
+                           prompt and injects the top-k relevant passages each
+                           turn, "full" puts the whole module in the system prompt
+            module_top_k: Number of module passages injected per turn
+            metrics_path: JSONL file per-turn metrics are appended to (optional)
+            route_tools: Send only the tools relevant to each turn instead of
+                         the full `functions` list
+            prefetch_rules: Search the rules for the player input in the
+                            background while the first completion runs
+            cassette: Record/replay store of the LLM calls (default: from the environment)
+        """
+        if scenario_mode not in ("retrieval", "full"):
+            raise ValueError(f"Unknown scenario mode: {scenario_mode}")
+        self.scenario_mode = scenario_mode
+        self.module_top_k = module_top_k
+        # Shares the process-wide model with the rule retriever
         self.embedding_manager = EmbeddingManager()
+        # Players and NPCs of this session
+        self.components = ComponentManager()
         self.module = ModuleStore(dimension=self.embedding_manager.dimension)
-        self.llm_manager = LLMManager()
+        self.llm_manager = LLMManager(cassette=cassette, tool_handler=self._handle_tool)
         self.conversation_history = []
+        self.history = HistoryManager(token_budget=history_token_budget)
+        self.metrics = SessionMetrics(path=metrics_path)
+        self.tool_router = ToolRouter(self.embedding_manager) if route_tools else None
+        self.prefetcher = RetrievalPrefetcher(get_vector_manager()) if prefetch_rules else None
 
     def load_module(self, module_texts: List[str]):
         """Load module texts into the vector store."""
-        print("Loading module texts into the vector store...")
-        embeddings = self.embedding_manager.get_embeddings(module_texts)
-        print("Embedding module texts done.")
-        print("Adding module texts to the vector store...")
+        logger.info("Loading module texts into the vector store...")
+        embeddings = self.embedding_manager.encode_bulk(module_texts)
+        logger.info("Embedding module texts done.")
+        logger.info("Adding module texts to the vector store...")
         self.module.add_texts(module_texts, embeddings)
-        print("Adding module texts to the vector store done.")
-        self.llm_manager.load_scenario(str(module_texts))
+        logger.info("Adding module texts to the vector store done.")
+        if self.scenario_mode == "retrieval":
+            self.llm_manager.load_scenario(self.module.synopsis())
+        else:
+            self.llm_manager.load_scenario("\n".join(module_texts))
+
+    def _prepare_turn(self, player_input: str) -> Tuple[str, Optional[List[Dict]]]:
+        """Get the module context and the tool schemas for a turn.
+
+        The player input is embedded once and shared by the module search,
+        the tool router and the rule prefetch.
+        """
+        query_embedding = self.embedding_manager.get_embedding(player_input)
+        if self.prefetcher is not None:
+            self.prefetcher.start(player_input, query_embedding)
+
+        module_context = ""
+        if self.scenario_mode == "retrieval":
+            relevant_texts = self.module.search(query_embedding, k=self.module_top_k)
+            module_context = "\n".join([text for text, _ in relevant_texts])
+
+        tools = None
+        if self.tool_router is not None:
+            decision = self.tool_router.select(player_input, query_embedding, recent_tool_names(self.conversation_history))
+            tools = decision.tools
+            turn = current_turn()
+            if turn is not None:
+                turn.tool_schema_tokens = decision.tokens_selected
+                turn.tool_schema_tokens_saved = decision.tokens_saved
+        return module_context, tools
         
     def process_player_input(self, player_input: str) -> str:
         """Process player input and generate game master response."""
-        # Get relevant context from vector store
-        # query_embedding = self.embedding_manager.get_embedding(player_input)
-        # relevant_texts = self.module.search(query_embedding)
-        # module_context = "\n".join([text for text, _ in relevant_texts])
-        
-        # Get response from LLM
-        self.conversation_history,response = self.llm_manager.get_response(
-            self.conversation_history,
-            player_input,
-            # module_context
-        )
+        with self.metrics.turn(player_input), self._rollback_on_error():
+            # Get relevant context from vector store
+            module_context, tools = self._prepare_turn(player_input)
+
+            # Get response from LLM
+            self.conversation_history,response = self.llm_manager.get_response(
+                self.conversation_history,
+                player_input,
+                module_context,
+                tools
+            )
+            return self._record_response(response)
+
+    def stream_player_input(self, player_input: str) -> Iterator[str]:
+        """Process player input and stream the game master response.
+
+        Yields text deltas as soon as the LLM produces them; the conversation
+        history is updated once the stream is exhausted.
+        """
+        with self.metrics.turn(player_input), self._rollback_on_error():
+            module_context, tools = self._prepare_turn(player_input)
+            self.conversation_history, response = yield from self.llm_manager.stream_response(
+                self.conversation_history,
+                player_input,
+                module_context,
+                tools,
+            )
+            if not response:
+                # Nothing was streamed, surface the error placeholder instead
+                yield self._record_response(response)
+            else:
+                self._record_response(response)
+
+    def _handle_tool(self, function_name: str, parameters: Dict) -> Any:
+        """Execute a tool call, serving rule lookups from the prefetch when possible."""
+        if self.prefetcher is not None:
+            prefetched = self.prefetcher.lookup(function_name, parameters)
+            if prefetched is not None:
+                return prefetched
+        return self.components.function_calling(function_name, parameters)
+
+    @contextmanager
+    def _rollback_on_error(self):
+        """Drop the partial turn from the history if the LLM call fails."""
+        history_length = len(self.conversation_history)
+        try:
+            yield
+        except Exception:
+            del self.conversation_history[history_length:]
+            raise
+
+    def _record_response(self, response: str) -> str:
+        """Append the assistant response to the conversation history."""
         if not response:
             response = "<Error: None response from assistant/>"
         self.conversation_history.append({
             "role": "assistant",
             "content": response
         })
-        return response 
\ No newline at end of file
+        # Keep the prompt size bounded over a long session
+        self.conversation_history = self.history.compact(self.conversation_history)
+        turn = current_turn()
+        if turn is not None:
+            turn.history_tokens = self.history.last_token_count
+            if self.llm_manager.last_loop is not None:
+                turn.stop_reason = self.llm_manager.last_loop.stop_reason
+        return response
@@ -0,0 +1,150 @@
+import re
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# CJK characters are roughly one token each, other text about four characters per token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]")
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PREFIX = "之前的剧情摘要（较早的对话已被压缩）：\n"
+# Module passages are retrieved fresh every turn, so they never stay in history
+_MODULE_CONTEXT_PATTERN = re.compile(r"\n?<module_context>.*?</module_context>\n?", re.S)
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Estimate the number of tokens in a text without loading a tokenizer."""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _as_dict(message: Any) -> Dict[str, Any]:
+    """History may hold openai message objects next to plain dicts."""
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude_none=True)
+    return message
+
+
+def count_message_tokens(messages: List[Any]) -> int:
+    """Estimate the prompt tokens taken by a list of chat messages."""
+    total = 0
+    for message in messages:
+        message = _as_dict(message)
+        total += MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content"))
+        for toolcall in message.get("tool_calls") or []:
+            function = toolcall.get("function", {})
+            total += count_tokens(function.get("name")) + count_tokens(function.get("arguments"))
+    return total
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def extractive_summary(summary: str, turns: List[List[Dict[str, Any]]], max_chars: int = 3000) -> str:
+    """Fold turns into the running summary without another LLM call.
+
+    Each turn is reduced to the player's action and the Keeper's final
+    narration; the oldest lines fall off once `max_chars` is reached.
+    """
+    lines = [summary] if summary else []
+    for turn in turns:
+        player = next((m.get("content") for m in turn if m.get("role") == "user"), "")
+        keeper = next((m.get("content") for m in reversed(turn) if m.get("role") == "assistant" and m.get("content")), "")
+        lines.append(f"- 玩家: {_truncate(player.replace('玩家行动:', ''), 120)} / KP: {_truncate(keeper, 240)}")
+    text = "\n".join(lines)
+    return text[-max_chars:]
+
+
+class HistoryManager:
+    """Keeps `conversation_history` within a token budget.
+
+    The most recent turns stay verbatim, except that tool results (whole
+    rule documents at times) are only kept in full for the last
+    `keep_tool_turns` turns and replaced by short stubs elsewhere. When the
+    history is still over budget the oldest turns are folded into a running
+    summary that is kept as a system message at the start of the history.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 8000,
+        keep_recent_turns: int = 4,
+        keep_tool_turns: int = 1,
+        tool_result_chars: int = 200,
+        summarizer: Optional[Callable[[str, List[List[Dict[str, Any]]]], str]] = None
+    ):
+        """Initialize the history manager.
+
+        Args:
+            token_budget: Target size of the history in (estimated) tokens
+            keep_recent_turns: Number of most recent turns never folded
+            keep_tool_turns: Number of most recent turns keeping full tool results
+            tool_result_chars: Characters kept from tool results of older turns
+            summarizer: Callable (summary, turns) -> new summary, defaults to
+                        `extractive_summary`
+        """
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.keep_tool_turns = keep_tool_turns
+        self.tool_result_chars = tool_result_chars
+        self.summarizer = summarizer or extractive_summary
+        self.summary = ""
+        self.last_token_count = 0
+
+    def _split_turns(self, messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split the history into turns, each starting with a user message."""
+        turns = []
+        for message in messages:
+            if message.get("role") == "system" and (message.get("content") or "").startswith(SUMMARY_PREFIX):
+                continue
+            if message.get("role") == "user" and "<module_context>" in (message.get("content") or ""):
+                message = {**message, "content": _MODULE_CONTEXT_PATTERN.sub("\n", message["content"])}
+            if message.get("role") == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def _stub_tool_results(self, turn: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        stubbed = []
+        for message in turn:
+            content = message.get("content") or ""
+            if message.get("role") == "tool" and len(content) > self.tool_result_chars:
+                message = {
+                    **message,
+                    "content": f"{content[:self.tool_result_chars]}…[工具结果已省略 {len(content) - self.tool_result_chars} 字符]"
+                }
+            stubbed.append(message)
+        return stubbed
+
+    def _assemble(self, turns: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        messages = [message for turn in turns for message in turn]
+        if self.summary:
+            messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        return messages
+
+    def compact(self, messages: List[Any]) -> List[Dict[str, Any]]:
+        """Return the history compacted to the token budget."""
+        turns = self._split_turns([_as_dict(m) for m in messages])
+        keep_tools = max(len(turns) - self.keep_tool_turns, 0)
+        turns = [self._stub_tool_results(turn) for turn in turns[:keep_tools]] + turns[keep_tools:]
+        split = max(len(turns) - self.keep_recent_turns, 0)
+        older = turns[:split]
+        recent = turns[split:]
+
+        compacted = self._assemble(older + recent)
+        folded = []
+        while older and count_message_tokens(compacted) > self.token_budget:
+            folded.append(older.pop(0))
+            compacted = self._assemble(older + recent)
+        if folded:
+            self.summary = self.summarizer(self.summary, folded)
+            compacted = self._assemble(older + recent)
+            logger.info(f"Folded {len(folded)} turns into the history summary")
+
+        self.last_token_count = count_message_tokens(compacted)
+        return compacted
@@ -1,27 +1,100 @@
-import os
 import json
-from typing import List, Dict
-from openai import OpenAI
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Dict, Iterator, Optional
 from dotenv import load_dotenv
-from .prompts import SYSTEM_PROMPT, USER_PROMPT, functions
-from .component_manager import function_calling, player_manager, npc_manager
+from .prompts import SYSTEM_PROMPT, USER_PROMPT, MODULE_CONTEXT_PROMPT, functions
+from .component_manager import function_calling, RULE_FUNCTIONS
+from .tool_loop import ToolLoop, TurnBudget
+from .cassette import Cassette
+from .llm_client import ResilientClient, AsyncResilientClient
+from . import metrics
 
 load_dotenv()
 model_name = "deepseek/deepseek-chat-v3-0324:free"
 
+# Tool calls without side effects on game state, safe to run concurrently
+CONCURRENT_FUNCTIONS = set(RULE_FUNCTIONS) | {"roll_dice"}
+
+# Reply of a turn that ran out of time before the model could answer
+DEADLINE_REPLY = "（守秘人思考得太久了，这一轮没能给出回应。请再描述一次你的行动。）"
+
+
+def _chunk_usage(chunk):
+    """Token usage of a stream chunk, None on all but the last one.
+
+    openai 1.12 does not model `usage` on chunks, so it arrives as a plain dict.
+    """
+    usage = getattr(chunk, "usage", None)
+    if isinstance(usage, dict):
+        from openai.types import CompletionUsage
+        usage = CompletionUsage.model_validate(usage)
+    return usage
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def serialize_tool_result(result: Any, max_chars: int = 6000) -> str:
+    """Serialize a tool result for the message list, capped at `max_chars`.
+
+    Results are compact JSON rather than the Python repr. An oversized dict
+    loses trailing items of its longest lists (and is marked `truncated`)
+    so it stays valid JSON; anything else is cut at the limit.
+    """
+    text = result if isinstance(result, str) else _compact_json(result)
+    if len(text) <= max_chars:
+        return text
+    if isinstance(result, dict):
+        trimmed = dict(result)
+        list_keys = sorted(
+            (k for k, v in result.items() if isinstance(v, list)),
+            key=lambda k: len(_compact_json(result[k])),
+            reverse=True
+        )
+        for key in list_keys:
+            items = list(trimmed[key])
+            while items and len(_compact_json(trimmed)) > max_chars:
+                items.pop()
+                trimmed[key] = items
+                trimmed["truncated"] = True
+        text = _compact_json(trimmed)
+        if len(text) <= max_chars:
+            return text
+    return text[:max_chars] + "…[truncated]"
+
 class LLMManager:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENROUTER_API_KEY"), base_url=os.getenv("OPENROUTER_URL"))
+    # Character cap of a single tool result in the message list
+    tool_result_chars = 6000
+    # Client built from LLM_ENDPOINTS
+    client_class = ResilientClient
+
+    def __init__(self, budget: Optional[TurnBudget] = None, cassette: Optional[Cassette] = None,
+                 tool_handler: Optional[Callable[[str, Dict[str, Any]], Any]] = None):
+        # Retries with backoff and fails over across LLM_ENDPOINTS
+        self.client = self.client_class.from_env(model_name)
         self.sys_prompt = SYSTEM_PROMPT
+        self.budget = budget or TurnBudget()
+        # Record/replay layer, configured by LLM_CASSETTE_MODE by default
+        self.cassette = cassette or Cassette.from_env()
+        # Executes tool calls, (function_name, parameters) -> result
+        self.tool_handler = tool_handler or function_calling
+        # Tool loop of the most recent turn, kept for inspection
+        self.last_loop: Optional[ToolLoop] = None
     
     def load_scenario(self, scenario: str):
         self.sys_prompt = SYSTEM_PROMPT.format(scenario=scenario)
         # print(f"System prompt: {self.sys_prompt}")
-        
-    def get_response(self, messages: List[Dict[str, str]], player_input: str, module_context: str = "") -> str:
-        """Get response from LLM with context."""
 
-        user_prompt = USER_PROMPT.format(player_input=player_input,)
+    def _build_messages(self, messages: List[Dict[str, str]], player_input: str, module_context: str = "") -> List[Dict[str, str]]:
+        """Append the player's turn to the history and prepend the system prompt."""
+        user_prompt = USER_PROMPT.format(
+            player_input=player_input,
+            module_context=MODULE_CONTEXT_PROMPT.format(passages=module_context) if module_context else "",
+        )
         # player_name=player_manager.players.keys()[0])#TODO: 玩家名字
         # print(f"User prompt: {user_prompt}")
 
@@ -33,40 +106,250 @@ class LLMManager:
             "role": "system",
             "content": self.sys_prompt
         }
+        return [system_message] + messages
+
+    def _call_tool(self, tool_call_id: str, function_name: str, arguments: str) -> Dict[str, str]:
+        """Run one tool call and wrap the result as a `tool` message."""
+        start = time.perf_counter()
+        error = False
+        try:
+            function_args = json.loads(arguments or "{}")
+            print(f"Calling function: {function_name}, {function_args}")
+            function_response = self.tool_handler(function_name, function_args)
+        except Exception as e:
+            print(f"Function calling error: {e}")
+            function_response = f"发生了一些错误:Function calling error: {e}"
+            error = True
+        metrics.record_tool_call(function_name, time.perf_counter() - start, error)
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call_id,
+            "content": serialize_tool_result(function_response, self.tool_result_chars)
+        }
         
-        full_messages = [system_message] + messages
-        response = self.client.chat.completions.create(
-            model=model_name,
-            messages=full_messages,
-            temperature=0.7,
-            tools=functions,
-        )
-        retry_times = 3
-        response = None
-        while retry_times > 0:
-            response = self.client.chat.completions.create(
-                model=model_name,
-                messages=full_messages,
-                temperature=0.7,
-                tools=functions,
-            )
-            toolcalls = response.choices[0].message.tool_calls
-            if toolcalls:
-                full_messages.append(response.choices[0].message)
-                for toolcall in toolcalls:
-                    function_name = toolcall.function.name
-                    function_args = json.loads(toolcall.function.arguments)
-                    try:
-                        print(f"Calling function: {function_name}, {function_args}")
-                        function_response = function_calling(function_name, function_args)
-                    except Exception as e:
-                        print(f"Function calling error: {e}")
-                        function_response = f"发生了一些错误:Function calling error: {e}"
-                    full_messages.append({
-                        "role": "tool",
-                        "tool_call_id": toolcall.id,
-                        "content": str(function_response)
+    def _completion_kwargs(self, full_messages: List[Dict], loop: ToolLoop, wrap_up: Optional[str] = None,
+                           tools: Optional[List[Dict]] = None) -> Dict:
+        """Arguments for one chat completion inside the tool loop."""
+        kwargs = {
+            "model": model_name,
+            "messages": full_messages,
+            "temperature": 0.7,
+            "tools": tools or functions,
+            # Never let a single completion outlive the turn deadline
+            "timeout": max(loop.remaining(), 1.0),
+        }
+        if wrap_up:
+            # Out of tool rounds or tokens, make the model answer with what it has
+            kwargs["tool_choice"] = "none"
+        return kwargs
+
+    def _create_completion(self, **kwargs):
+        """Create a chat completion through the record/replay cassette."""
+        return self.cassette.create(self.client.create, **kwargs)
+
+    def get_response(self, messages: List[Dict[str, str]], player_input: str, module_context: str = "",
+                     tools: Optional[List[Dict]] = None) -> str:
+        """Get response from LLM with context.
+
+        Tool calls are executed until the model answers or the turn budget
+        runs out; see `last_loop.stop_reason` for why the turn stopped. Out of
+        tool rounds or tokens, the model is asked once more to answer without
+        tools; out of time, the turn ends with `DEADLINE_REPLY`.
+        `tools` narrows the tool schemas sent (defaults to all `functions`).
+        """
+        from openai import APITimeoutError
+        full_messages = self._build_messages(messages, player_input, module_context)
+        loop = ToolLoop(self.budget)
+        self.last_loop = loop
+        content = None
+        # Budget that ran out, set for the final tool-less completion
+        wrap_up = None
+        while True:
+            try:
+                response = self._create_completion(**self._completion_kwargs(full_messages, loop, wrap_up, tools))
+            except APITimeoutError:
+                loop.finish(ToolLoop.DEADLINE)
+                content = DEADLINE_REPLY
+                break
+            loop.record_completion(response.usage)
+            message = response.choices[0].message
+            content = message.content
+            if wrap_up or not message.tool_calls:
+                loop.finish(wrap_up or ToolLoop.FINAL_ANSWER)
+                break
+            full_messages.append(message)
+            for toolcall in message.tool_calls:
+                full_messages.append(self._call_tool(toolcall.id, toolcall.function.name, toolcall.function.arguments))
+            exhausted = loop.record_tool_round()
+            if exhausted == ToolLoop.DEADLINE:
+                loop.finish(exhausted)
+                content = DEADLINE_REPLY
+                break
+            wrap_up = exhausted
+        return full_messages[1:], content
+
+    def stream_response(self, messages: List[Dict[str, str]], player_input: str, module_context: str = "",
+                        tools: Optional[List[Dict]] = None) -> Iterator[str]:
+        """Stream the LLM response, yielding text deltas as they arrive.
+
+        Tool call fragments are accumulated from the stream; once a round
+        finishes with tool calls they are executed and the conversation
+        continues until the model produces a final answer. Like
+        `get_response`, the generator returns `(messages, content)`, which
+        callers can pick up with `yield from`.
+        """
+        from openai import APITimeoutError
+        full_messages = self._build_messages(messages, player_input, module_context)
+        loop = ToolLoop(self.budget)
+        self.last_loop = loop
+        content = None
+        # Budget that ran out, set for the final tool-less completion
+        wrap_up = None
+        while True:
+            kwargs = self._completion_kwargs(full_messages, loop, wrap_up, tools)
+            try:
+                stream = self._create_completion(
+                    stream=True,
+                    # Ask for a final usage chunk so the token budget applies
+                    extra_body={"stream_options": {"include_usage": True}},
+                    **kwargs,
+                )
+            except APITimeoutError:
+                loop.finish(ToolLoop.DEADLINE)
+                content = DEADLINE_REPLY
+                yield content
+                break
+            content_parts = []
+            toolcalls: Dict[int, Dict] = {}
+            usage = None
+            for chunk in stream:
+                usage = _chunk_usage(chunk) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield delta.content
+                # Tool calls arrive in fragments keyed by index: the id and
+                # name come first, the JSON arguments are spread over chunks.
+                for fragment in delta.tool_calls or []:
+                    toolcall = toolcalls.setdefault(fragment.index, {
+                        "id": "",
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
                     })
-            else:
+                    if fragment.id:
+                        toolcall["id"] = fragment.id
+                    if fragment.function:
+                        if fragment.function.name:
+                            toolcall["function"]["name"] += fragment.function.name
+                        if fragment.function.arguments:
+                            toolcall["function"]["arguments"] += fragment.function.arguments
+            loop.record_completion(usage)
+            content = "".join(content_parts) or None
+            if wrap_up or not toolcalls:
+                loop.finish(wrap_up or ToolLoop.FINAL_ANSWER)
+                break
+            ordered = [toolcalls[index] for index in sorted(toolcalls)]
+            full_messages.append({
+                "role": "assistant",
+                "content": content,
+                "tool_calls": ordered
+            })
+            for toolcall in ordered:
+                full_messages.append(self._call_tool(toolcall["id"], toolcall["function"]["name"], toolcall["function"]["arguments"]))
+            exhausted = loop.record_tool_round()
+            if exhausted == ToolLoop.DEADLINE:
+                loop.finish(exhausted)
+                content = DEADLINE_REPLY
+                yield content
+                break
+            wrap_up = exhausted
+        return full_messages[1:], content
+
+
+class AsyncLLMManager(LLMManager):
+    """Asyncio variant of LLMManager built on AsyncOpenAI.
+
+    The rule lookups of one assistant message run concurrently on a bounded
+    thread pool, because embedding and pgvector work is blocking. Calls that
+    change game state still run one after another in the order the model
+    asked for them, and tool messages keep the `tool_call_id` order.
+    """
+
+    client_class = AsyncResilientClient
+
+    def __init__(self, max_workers: int = 4, budget: Optional[TurnBudget] = None, cassette: Optional[Cassette] = None,
+                 tool_handler: Optional[Callable[[str, Dict[str, Any]], Any]] = None):
+        super().__init__(budget=budget, cassette=cassette, tool_handler=tool_handler)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="coc-tool")
+
+    def _create_completion(self, **kwargs):
+        raise NotImplementedError("AsyncLLMManager creates completions with `await self.cassette.acreate(...)`")
+
+    def stream_response(self, *args, **kwargs):
+        raise NotImplementedError("AsyncLLMManager does not stream; use LLMManager.stream_response")
+
+    async def _run_toolcalls(self, toolcalls) -> List[Dict[str, str]]:
+        """Execute the tool calls of one assistant message."""
+        loop = asyncio.get_running_loop()
+        results = [None] * len(toolcalls)
+
+        async def run(index, toolcall):
+            # Worker threads do not inherit the context, carry the turn metrics over
+            context = contextvars.copy_context()
+            results[index] = await loop.run_in_executor(
+                self.executor,
+                context.run,
+                self._call_tool,
+                toolcall.id,
+                toolcall.function.name,
+                toolcall.function.arguments,
+            )
+
+        async def run_in_order(indexed_toolcalls):
+            for index, toolcall in indexed_toolcalls:
+                await run(index, toolcall)
+
+        stateful = [(i, toolcall) for i, toolcall in enumerate(toolcalls) if toolcall.function.name not in CONCURRENT_FUNCTIONS]
+        concurrent = [run(i, toolcall) for i, toolcall in enumerate(toolcalls) if toolcall.function.name in CONCURRENT_FUNCTIONS]
+        await asyncio.gather(run_in_order(stateful), *concurrent)
+        return results
+
+    async def get_response(self, messages: List[Dict[str, str]], player_input: str, module_context: str = "",
+                     tools: Optional[List[Dict]] = None) -> str:
+        """Get response from LLM with context."""
+        from openai import APITimeoutError
+        full_messages = self._build_messages(messages, player_input, module_context)
+        loop = ToolLoop(self.budget)
+        self.last_loop = loop
+        content = None
+        # Budget that ran out, set for the final tool-less completion
+        wrap_up = None
+        while True:
+            try:
+                response = await self.cassette.acreate(self.client.create, **self._completion_kwargs(full_messages, loop, wrap_up, tools))
+            except APITimeoutError:
+                loop.finish(ToolLoop.DEADLINE)
+                content = DEADLINE_REPLY
                 break
-        return full_messages[1:], response.choices[0].message.content 
+            loop.record_completion(response.usage)
+            message = response.choices[0].message
+            content = message.content
+            if wrap_up or not message.tool_calls:
+                loop.finish(wrap_up or ToolLoop.FINAL_ANSWER)
+                break
+            full_messages.append(message)
+            full_messages.extend(await self._run_toolcalls(message.tool_calls))
+            exhausted = loop.record_tool_round()
+            if exhausted == ToolLoop.DEADLINE:
+                loop.finish(exhausted)
+                content = DEADLINE_REPLY
+                break
+            wrap_up = exhausted
+        return full_messages[1:], content
+
+    async def aclose(self):
+        """Close the HTTP client and shut down the tool worker pool."""
+        await self.client.close()
+        self.executor.shutdown(wait=False)
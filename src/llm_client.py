@@ -0,0 +1,349 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+# The openai SDK is imported where it is used: it takes a large share of
+# the game's import time
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_PATTERN = re.compile(r"(?:\d+(?:\.\d+)?(?:ms|h|m|s))+")
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when no endpoint could be tried, e.g. every circuit is open."""
+
+
+class Endpoint(BaseModel):
+    """One OpenAI-compatible endpoint/model pair to fail over across."""
+    base_url: Optional[str] = None
+    api_key_env: str = "OPENROUTER_API_KEY"
+    model: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """Rate limits are tracked per API key and endpoint."""
+        return f"{self.api_key_env}@{self.base_url}"
+
+    @property
+    def name(self) -> str:
+        return f"{self.base_url or 'default'}/{self.model or '-'}"
+
+
+class CircuitBreaker:
+    """Per-endpoint circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and the
+    endpoint is skipped for `reset_timeout` seconds; then a single trial
+    request is let through (half-open) and decides whether it closes again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def _parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until a rate limit resets, from Retry-After or x-ratelimit-reset.
+
+    Accepts plain seconds, epoch seconds/milliseconds (OpenRouter), HTTP dates
+    and durations such as "1m30s" or "250ms" (OpenAI).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        if number > 1e12:
+            return max(number / 1000 - time.time(), 0.0)
+        if number > 1e9:
+            return max(number - time.time(), 0.0)
+        return max(number, 0.0)
+    if _DURATION_PATTERN.fullmatch(value):
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(amount) * units[unit] for amount, unit in _DURATION_PART.findall(value))
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitTracker:
+    """Remembers until when each API key is rate limited."""
+
+    def __init__(self):
+        self._blocked_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait_time(self, key: str) -> float:
+        with self._lock:
+            return max(self._blocked_until.get(key, 0.0) - time.monotonic(), 0.0)
+
+    def block(self, key: str, seconds: float) -> None:
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), until)
+
+    def update_from_headers(self, key: str, headers) -> Optional[float]:
+        """Track limits from response headers; returns the wait if now blocked."""
+        if headers is None:
+            return None
+        retry_after = _parse_reset(headers.get("retry-after-ms"))
+        if retry_after is not None:
+            retry_after /= 1000
+        else:
+            retry_after = _parse_reset(headers.get("retry-after"))
+        remaining = headers.get("x-ratelimit-remaining") or headers.get("x-ratelimit-remaining-requests")
+        if retry_after is None and remaining is not None and remaining.strip() == "0":
+            retry_after = _parse_reset(headers.get("x-ratelimit-reset") or headers.get("x-ratelimit-reset-requests"))
+        if retry_after is not None:
+            self.block(key, retry_after)
+        return retry_after
+
+
+def load_endpoints(default_model: str) -> List[Endpoint]:
+    """Ordered failover endpoints.
+
+    Read from LLM_ENDPOINTS (a JSON list of {"base_url", "api_key_env",
+    "model"}); defaults to OPENROUTER_URL with `default_model`.
+    """
+    raw = os.getenv("LLM_ENDPOINTS")
+    if raw:
+        endpoints = [Endpoint(**item) for item in json.loads(raw)]
+        for endpoint in endpoints:
+            endpoint.model = endpoint.model or default_model
+        return endpoints
+    return [Endpoint(base_url=os.getenv("OPENROUTER_URL"), model=default_model)]
+
+
+# Errors of one endpoint's setup (key, credits, access, served models) rather
+# than of the request: another endpoint may well accept it
+ENDPOINT_ERRORS = (401, 402, 403, 404)
+
+
+class _ResilientBase:
+    """Retry, rate-limit and failover policy shared by the sync and async clients."""
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0
+    ):
+        """Initialize the client.
+
+        Args:
+            endpoints: Endpoints in order of preference
+            max_attempts: Rounds over all endpoints before giving up
+            base_delay: Base of the exponential backoff in seconds
+            max_delay: Cap of a single backoff sleep in seconds
+            failure_threshold: Consecutive failures that open an endpoint's circuit
+            reset_timeout: Seconds an open circuit waits before a trial request
+        """
+        if not endpoints:
+            raise ValueError("At least one LLM endpoint is required")
+        self.endpoints = endpoints
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breakers = {e.name: CircuitBreaker(failure_threshold, reset_timeout) for e in endpoints}
+        self.rate_limits = RateLimitTracker()
+
+    def _candidates(self) -> Tuple[List[Endpoint], float]:
+        """Endpoints usable right now, and the shortest wait if there are none."""
+        usable, waits = [], []
+        for endpoint in self.endpoints:
+            if not self.breakers[endpoint.name].allow():
+                continue
+            wait = self.rate_limits.wait_time(endpoint.key)
+            if wait > 0:
+                waits.append(wait)
+            else:
+                usable.append(endpoint)
+        return usable, min(waits, default=0.0)
+
+    def _backoff(self, attempt: int, min_wait: float) -> float:
+        """Exponential backoff with full jitter, never shorter than a known Retry-After."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, min_wait)
+
+    def _handle_error(self, endpoint: Endpoint, error: Exception) -> bool:
+        """Book-keep a failed request; re-raise errors no endpoint can fix (400, 422, ...).
+
+        Returns:
+            True if the endpoint itself rejected the request (`ENDPOINT_ERRORS`),
+            so it is skipped for the rest of this request
+        """
+        from openai import APIStatusError, RateLimitError
+        if isinstance(error, RateLimitError):
+            wait = self.rate_limits.update_from_headers(endpoint.key, error.response.headers)
+            if wait is None:
+                self.rate_limits.block(endpoint.key, self.base_delay)
+            logger.warning(f"Rate limited on {endpoint.name}, retry in {wait or self.base_delay:.1f}s")
+            return False
+        if isinstance(error, APIStatusError) and error.status_code in ENDPOINT_ERRORS:
+            self.breakers[endpoint.name].record_failure()
+            logger.warning(f"LLM endpoint {endpoint.name} rejected the request ({error.status_code}), failing over")
+            return True
+        if isinstance(error, APIStatusError) and error.status_code < 500 and error.status_code not in (408, 409):
+            raise error
+        self.breakers[endpoint.name].record_failure()
+        logger.warning(f"LLM endpoint {endpoint.name} failed: {error}")
+        return False
+
+    @staticmethod
+    def _deadline(kwargs: Dict[str, Any]) -> Optional[float]:
+        timeout = kwargs.get("timeout")
+        return time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+
+    @staticmethod
+    def _request(endpoint: Endpoint, kwargs: Dict[str, Any], deadline: Optional[float]) -> Dict[str, Any]:
+        request = {**kwargs, "model": endpoint.model or kwargs.get("model")}
+        if deadline is not None:
+            request["timeout"] = max(deadline - time.monotonic(), 1.0)
+        return request
+
+
+class ResilientClient(_ResilientBase):
+    """Chat completions with backoff, rate-limit awareness and failover.
+
+    Drop-in for `client.chat.completions.create`. Retries stop at the
+    request's `timeout`, so the turn deadline still holds. Streams are only
+    retried before the first chunk arrives.
+    """
+
+    def __init__(self, endpoints: List[Endpoint], **kwargs):
+        super().__init__(endpoints, **kwargs)
+        from openai import OpenAI
+        # The SDK's own retries would hide 429s from the rate-limit tracking
+        self.clients = {
+            e.name: OpenAI(api_key=os.getenv(e.api_key_env), base_url=e.base_url, max_retries=0)
+            for e in endpoints
+        }
+
+    @classmethod
+    def from_env(cls, default_model: str, **kwargs) -> "ResilientClient":
+        return cls(load_endpoints(default_model), **kwargs)
+
+    def create(self, **kwargs):
+        from openai import APIConnectionError, APIStatusError
+        deadline = self._deadline(kwargs)
+        last_error: Exception = LLMUnavailableError("No LLM endpoint available")
+        rejected = set()
+        for attempt in range(self.max_attempts):
+            usable, min_wait = self._candidates()
+            for endpoint in [e for e in usable if e.name not in rejected]:
+                try:
+                    raw = self.clients[endpoint.name].chat.completions.with_raw_response.create(
+                        **self._request(endpoint, kwargs, deadline)
+                    )
+                except (APIStatusError, APIConnectionError) as e:
+                    if self._handle_error(endpoint, e):
+                        rejected.add(endpoint.name)
+                    last_error = e
+                    continue
+                self.breakers[endpoint.name].record_success()
+                self.rate_limits.update_from_headers(endpoint.key, raw.headers)
+                return raw.parse()
+            if len(rejected) == len(self.breakers):
+                # Every endpoint refused it, waiting will not change that
+                break
+            delay = self._backoff(attempt, min_wait)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+        raise last_error
+
+    def close(self) -> None:
+        for client in self.clients.values():
+            client.close()
+
+
+class AsyncResilientClient(_ResilientBase):
+    """Asyncio counterpart of `ResilientClient`."""
+
+    def __init__(self, endpoints: List[Endpoint], **kwargs):
+        super().__init__(endpoints, **kwargs)
+        from openai import AsyncOpenAI
+        self.clients = {
+            e.name: AsyncOpenAI(api_key=os.getenv(e.api_key_env), base_url=e.base_url, max_retries=0)
+            for e in endpoints
+        }
+
+    @classmethod
+    def from_env(cls, default_model: str, **kwargs) -> "AsyncResilientClient":
+        return cls(load_endpoints(default_model), **kwargs)
+
+    async def create(self, **kwargs):
+        from openai import APIConnectionError, APIStatusError
+        deadline = self._deadline(kwargs)
+        last_error: Exception = LLMUnavailableError("No LLM endpoint available")
+        rejected = set()
+        for attempt in range(self.max_attempts):
+            usable, min_wait = self._candidates()
+            for endpoint in [e for e in usable if e.name not in rejected]:
+                try:
+                    raw = await self.clients[endpoint.name].chat.completions.with_raw_response.create(
+                        **self._request(endpoint, kwargs, deadline)
+                    )
+                except (APIStatusError, APIConnectionError) as e:
+                    if self._handle_error(endpoint, e):
+                        rejected.add(endpoint.name)
+                    last_error = e
+                    continue
+                self.breakers[endpoint.name].record_success()
+                self.rate_limits.update_from_headers(endpoint.key, raw.headers)
+                return raw.parse()
+            if len(rejected) == len(self.breakers):
+                # Every endpoint refused it, waiting will not change that
+                break
+            delay = self._backoff(attempt, min_wait)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+        raise last_error
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
@@ -0,0 +1,181 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+# Metrics of the turn being processed in the current context, if any
+_current_turn: ContextVar[Optional["TurnMetrics"]] = ContextVar("current_turn", default=None)
+_lock = threading.Lock()
+
+
+class ToolCallMetric(BaseModel):
+    name: str
+    seconds: float
+    error: bool = False
+
+
+class TurnMetrics(BaseModel):
+    """Cost and latency of one `process_player_input` call."""
+    turn: int
+    started_at: float = Field(default_factory=time.time, description="Unix timestamp")
+    player_input: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    completions: int = Field(default=0, description="Completion round trips")
+    tool_calls: List[ToolCallMetric] = Field(default_factory=list)
+    prefetch_hits: int = Field(default=0, description="Rule lookups served from the turn's prefetch")
+    embedding_calls: int = 0
+    embedding_seconds: float = 0.0
+    embedding_cache_hits: int = 0
+    embedding_cache_misses: int = 0
+    db_calls: int = Field(default=0, description="pgvector queries")
+    db_seconds: float = 0.0
+    db_pool_wait_calls: int = Field(default=0, description="Connections taken from the pool")
+    db_pool_wait_seconds: float = 0.0
+    db_pool_size: int = Field(default=0, description="Largest pool size seen during the turn")
+    wall_seconds: float = 0.0
+    stop_reason: Optional[str] = None
+    history_tokens: int = 0
+    tool_schema_tokens: int = Field(default=0, description="Estimated tokens of the tool schemas sent")
+    tool_schema_tokens_saved: int = Field(default=0, description="Tokens saved by tool routing, per completion")
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def current_turn() -> Optional[TurnMetrics]:
+    """Metrics of the turn being processed, or None outside a turn."""
+    return _current_turn.get()
+
+
+def record_completion(usage) -> None:
+    """Count one completion round trip and its token usage."""
+    turn = _current_turn.get()
+    if turn is None:
+        return
+    with _lock:
+        turn.completions += 1
+        if usage is not None:
+            turn.prompt_tokens += usage.prompt_tokens or 0
+            turn.completion_tokens += usage.completion_tokens or 0
+
+
+def record_tool_call(name: str, seconds: float, error: bool = False) -> None:
+    turn = _current_turn.get()
+    if turn is None:
+        return
+    with _lock:
+        turn.tool_calls.append(ToolCallMetric(name=name, seconds=round(seconds, 4), error=error))
+
+
+def record_embedding_cache(hits: int, misses: int) -> None:
+    turn = _current_turn.get()
+    if turn is None:
+        return
+    with _lock:
+        turn.embedding_cache_hits += hits
+        turn.embedding_cache_misses += misses
+
+
+def record_db_pool(size: int) -> None:
+    turn = _current_turn.get()
+    if turn is None:
+        return
+    with _lock:
+        turn.db_pool_size = max(turn.db_pool_size, size)
+
+
+@contextmanager
+def timed(kind: str) -> Iterator[None]:
+    """Time a block of "embedding", "db" (query) or "db_pool_wait" work."""
+    turn = _current_turn.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if turn is not None:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                setattr(turn, f"{kind}_seconds", getattr(turn, f"{kind}_seconds") + elapsed)
+                setattr(turn, f"{kind}_calls", getattr(turn, f"{kind}_calls") + 1)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+class SessionMetrics:
+    """Collects the per-turn metrics of a game session."""
+
+    def __init__(self, path: Optional[str] = None):
+        """Initialize the session metrics.
+
+        Args:
+            path: JSONL file every finished turn is appended to (optional)
+        """
+        self.path = path
+        self.turns: List[TurnMetrics] = []
+
+    @contextmanager
+    def turn(self, player_input: str = "") -> Iterator[TurnMetrics]:
+        """Record the metrics of one turn for the duration of the block."""
+        metrics = TurnMetrics(turn=len(self.turns) + 1, player_input=player_input[:200])
+        token = _current_turn.set(metrics)
+        start = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics.wall_seconds = round(time.perf_counter() - start, 4)
+            _current_turn.reset(token)
+            self.turns.append(metrics)
+            if self.path:
+                self.append_jsonl(metrics)
+
+    def append_jsonl(self, metrics: TurnMetrics) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(metrics.model_dump_json() + "\n")
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregate the turns of the session."""
+        wall = [t.wall_seconds for t in self.turns]
+        tool_seconds: Dict[str, List[float]] = {}
+        for t in self.turns:
+            for call in t.tool_calls:
+                tool_seconds.setdefault(call.name, []).append(call.seconds)
+        cache_hits = sum(t.embedding_cache_hits for t in self.turns)
+        cache_lookups = cache_hits + sum(t.embedding_cache_misses for t in self.turns)
+        slowest = sorted(self.turns, key=lambda t: t.wall_seconds, reverse=True)[:3]
+        return {
+            "turns": len(self.turns),
+            "prompt_tokens": sum(t.prompt_tokens for t in self.turns),
+            "completion_tokens": sum(t.completion_tokens for t in self.turns),
+            "completions": sum(t.completions for t in self.turns),
+            "tool_calls": sum(len(t.tool_calls) for t in self.turns),
+            "prefetch_hits": sum(t.prefetch_hits for t in self.turns),
+            "tool_schema_tokens_saved": sum(t.tool_schema_tokens_saved * t.completions for t in self.turns),
+            "embedding_seconds": round(sum(t.embedding_seconds for t in self.turns), 3),
+            "embedding_cache_hit_rate": round(cache_hits / cache_lookups, 4) if cache_lookups else 0.0,
+            "db_seconds": round(sum(t.db_seconds for t in self.turns), 3),
+            "db_pool_wait_seconds": round(sum(t.db_pool_wait_seconds for t in self.turns), 3),
+            "db_pool_size_max": max((t.db_pool_size for t in self.turns), default=0),
+            "wall_seconds_p50": _percentile(wall, 0.5),
+            "wall_seconds_p95": _percentile(wall, 0.95),
+            "wall_seconds_max": max(wall, default=0.0),
+            "tool_seconds_avg": {
+                name: round(sum(values) / len(values), 4) for name, values in tool_seconds.items()
+            },
+            "slowest_turns": [{"turn": t.turn, "wall_seconds": t.wall_seconds, "player_input": t.player_input} for t in slowest],
+        }
+
+    def format_summary(self) -> str:
+        return json.dumps(self.summary(), ensure_ascii=False, indent=2)
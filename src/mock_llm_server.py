@@ -0,0 +1,373 @@
+"""
+Local OpenAI-compatible mock of the chat completions API for load testing.
+
+Point the game at it with OPENROUTER_URL=http://localhost:8001/v1 and every
+completion is answered from a script instead of a real model, while tool
+calls still run through the real tool and retrieval path.
+
+    python -m src.mock_llm_server --port 8001 --latency-ms 400 --tokens-per-sec 60
+"""
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional
+
+from .prompts import functions
+from .history import count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Appended to every final answer. The next turn of the session is found from
+# the last marker in the history, which survives history compaction, unlike
+# a count of the user messages
+TURN_MARKER = "[mock turn {turn}]"
+TURN_MARKER_RE = re.compile(r"\[mock turn (\d+)\]")
+
+PLAYER = "阿米蒂奇"
+NPC = "深潜者"
+
+# One entry per session turn: turn n of a session plays entry n (cycling).
+# Each step is either a tool-call round or the final answer; "{input}" is
+# replaced by the player's input. Together the turns call every function
+# in src/prompts.py.
+DEFAULT_SCRIPT: Dict[str, Any] = {
+    "turns": [
+        {"steps": [
+            {"tool_calls": [
+                {"name": "create_role", "arguments": {"name": PLAYER, "STR": 50, "CON": 60, "SIZ": 65, "DEX": 55, "APP": 45, "INT": 80, "POW": 60, "EDU": 85, "MOV": 8, "occupation": "图书馆员", "skills": {"图书馆使用": 70, "侦查": 60, "格斗": 40, "闪避": 30, "心理学": 50}, "is_player": True}},
+                {"name": "create_role", "arguments": {"name": NPC, "STR": 85, "CON": 80, "SIZ": 80, "DEX": 50, "APP": 20, "INT": 65, "POW": 50, "EDU": 20, "MOV": 8, "occupation": "怪物", "skills": {"格斗": 45, "闪避": 25}, "is_player": False}},
+            ]},
+            {"content": "调查员已经建立完毕。夜色笼罩着阿卡姆，你站在米斯卡托尼克大学图书馆门前。你打算怎么做？"},
+        ]},
+        {"steps": [
+            {"tool_calls": [{"name": "retrieve_coc_rules_skills", "arguments": {"query": "{input}"}}]},
+            {"tool_calls": [{"name": "perform_skill_check", "arguments": {"role_name": PLAYER, "skill_name": "侦查", "difficulty": "normal", "allow_pushed": False}}]},
+            {"content": "你仔细搜寻着书架之间的阴影，注意到一本没有书名的皮面古籍。"},
+        ]},
+        {"steps": [
+            {"tool_calls": [
+                {"name": "search_all_rules", "arguments": {"query": "{input}", "limit": 5}},
+                {"name": "retrieve_coc_rules_game_system", "arguments": {"query": "{input}"}},
+                {"name": "retrieve_coc_rules_keeper_guide", "arguments": {"query": "{input}"}},
+            ]},
+            {"content": "古籍的纸页冰冷而潮湿，字迹像是在纸面下缓缓蠕动。"},
+        ]},
+        {"steps": [
+            {"tool_calls": [
+                {"name": "retrieve_coc_rules_sanity", "arguments": {"query": "{input}"}},
+                {"name": "roll_dice", "arguments": {"dice_num": 1, "faces": 100}},
+            ]},
+            {"tool_calls": [{"name": "apply_sanity_damage", "arguments": {"role_name": PLAYER, "damage": 3, "damage_type": "temporary"}}]},
+            {"tool_calls": [{"name": "check_madness", "arguments": {"role_name": PLAYER, "sanity_loss": 3}}]},
+            {"content": "你读到的文字在脑海中回响，一阵眩晕袭来，但你勉强保持住了理智。"},
+        ]},
+        {"steps": [
+            {"tool_calls": [
+                {"name": "retrieve_coc_rules_combat", "arguments": {"query": "{input}"}},
+                {"name": "retrieve_coc_mythos_creatures_gods", "arguments": {"query": "深潜者"}},
+                {"name": "start_combat", "arguments": {"participants": [PLAYER, NPC]}},
+            ]},
+            {"tool_calls": [
+                {"name": "perform_attack", "arguments": {"attacker_name": PLAYER, "target_name": NPC, "weapon": "格斗", "difficulty": "normal"}},
+                {"name": "attempt_dodge", "arguments": {"role_name": PLAYER, "difficulty": "normal"}},
+            ]},
+            {"tool_calls": [
+                {"name": "fight_back", "arguments": {"defender_name": PLAYER, "attacker_name": NPC, "weapon": "格斗", "difficulty": "normal"}},
+                {"name": "apply_damage", "arguments": {"role_name": PLAYER, "damage": 2, "damage_type": "normal"}},
+            ]},
+            {"tool_calls": [{"name": "end_combat", "arguments": {"combat_id": "1000"}}]},
+            {"content": "湿滑的身影退回了黑暗之中，你的手臂上留下了一道伤口。"},
+        ]},
+        {"steps": [
+            {"tool_calls": [
+                {"name": "retrieve_coc_rules_chase", "arguments": {"query": "{input}"}},
+                {"name": "retrieve_coc_rules_alien_technology", "arguments": {"query": "{input}"}},
+                {"name": "retrieve_coc_rules_investigator_creation", "arguments": {"query": "{input}"}},
+                {"name": "get_available_rule_documents", "arguments": {}},
+            ]},
+            {"content": "你沿着走廊奔逃，身后传来潮湿的脚步声。"},
+        ]},
+        {"steps": [
+            {"tool_calls": [
+                {"name": "improve_skill", "arguments": {"role_name": PLAYER, "skill_name": "侦查", "amount": 3}},
+                {"name": "get_investigator_status", "arguments": {"role_name": PLAYER}},
+            ]},
+            {"content": "天亮了。你疲惫地坐在图书馆的台阶上，回想着昨夜发生的一切。"},
+        ]},
+        {"steps": [
+            {"content": "雨水敲打着窗户。KP 静静地等待着你的下一步行动：{input}"},
+        ]},
+    ]
+}
+
+
+def _validate_script(script: Dict[str, Any]) -> None:
+    """Warn about tools the script calls that do not exist, and those it never calls."""
+    known = {f["function"]["name"] for f in functions}
+    used = set()
+    for turn in script["turns"]:
+        for step in turn["steps"]:
+            for call in step.get("tool_calls", []):
+                used.add(call["name"])
+    for name in sorted(used - known):
+        logger.warning(f"Script calls unknown tool: {name}")
+    for name in sorted(known - used):
+        logger.info(f"Script never calls tool: {name}")
+
+
+def _fill(value: Any, player_input: str) -> Any:
+    if isinstance(value, str):
+        return value.replace("{input}", player_input)
+    if isinstance(value, dict):
+        return {k: _fill(v, player_input) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, player_input) for v in value]
+    return value
+
+
+class MockLLM:
+    """Decides the reply to a chat completion request from the script.
+
+    Stateless across requests: the session turn follows the `TURN_MARKER`
+    of the last final answer in the request, and the step is the number of
+    assistant messages since the last user message, so any number of
+    concurrent sessions can share one server.
+    """
+
+    def __init__(self, script: Optional[Dict[str, Any]] = None, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, tokens_per_sec: float = 0.0, error_rate: float = 0.0):
+        """Initialize the mock.
+
+        Args:
+            script: Scripted turns, see DEFAULT_SCRIPT for the format. A turn
+                    may carry a "match" regex tested against the player input;
+                    matching turns win over the positional one.
+            latency_ms: Delay before the first token
+            jitter_ms: Random extra delay on top of latency_ms
+            tokens_per_sec: Completion token rate, 0 for instant
+            error_rate: Fraction of requests answered with a 429 or 503
+        """
+        self.script = script or DEFAULT_SCRIPT
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        _validate_script(self.script)
+
+    def first_token_delay(self) -> float:
+        return (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+
+    def token_delay(self, tokens: int) -> float:
+        return tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def reply(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """The assistant message (content or tool_calls) for a request."""
+        messages = request.get("messages", [])
+        user_turns = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+        last_user = user_turns[-1] if user_turns else -1
+        player_input = messages[last_user].get("content", "") if user_turns else ""
+        match = re.search(r"玩家行动:\s*(.*)", player_input)
+        player_input = match.group(1).strip() if match else player_input.strip()
+        step_index = sum(1 for m in messages[last_user + 1:] if m.get("role") == "assistant")
+        turn_number = 0
+        for message in reversed(messages[:max(last_user, 0)]):
+            marker = TURN_MARKER_RE.search(str(message.get("content") or "")) if message.get("role") == "assistant" else None
+            if marker:
+                turn_number = int(marker.group(1)) + 1
+                break
+
+        turns = self.script["turns"]
+        turn = next((t for t in turns if t.get("match") and re.search(t["match"], player_input)), None)
+        if turn is None:
+            positional = [t for t in turns if not t.get("match")] or turns
+            turn = positional[turn_number % len(positional)]
+        steps = turn["steps"]
+        step = steps[min(step_index, len(steps) - 1)]
+        if "tool_calls" in step and (request.get("tool_choice") == "none" or not request.get("tools")):
+            # Tools are not allowed on this request, answer with the final step
+            step = steps[-1] if "content" in steps[-1] else {"content": "（模拟回复）"}
+        if "tool_calls" in step:
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:24]}",
+                        "type": "function",
+                        "function": {
+                            "name": call["name"],
+                            "arguments": json.dumps(_fill(call.get("arguments", {}), player_input), ensure_ascii=False)
+                        }
+                    }
+                    for call in step["tool_calls"]
+                ]
+            }
+        content = _fill(step["content"], player_input) + " " + TURN_MARKER.format(turn=turn_number)
+        return {"role": "assistant", "content": content}
+
+    @staticmethod
+    def usage(request: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, int]:
+        prompt_tokens = count_message_tokens(request.get("messages", []))
+        prompt_tokens += count_tokens(json.dumps(request.get("tools") or [], ensure_ascii=False))
+        completion_tokens = count_message_tokens([message])
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        message = self.reply(request)
+        usage = self.usage(request, message)
+        time.sleep(self.first_token_delay() + self.token_delay(usage["completion_tokens"]))
+        return {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"
+            }],
+            "usage": usage
+        }
+
+    def stream(self, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Chunks of a streamed completion, paced by latency and token rate."""
+        message = self.reply(request)
+        usage = self.usage(request, message)
+        base = {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        time.sleep(self.first_token_delay())
+        yield chunk({"role": "assistant", "content": ""})
+        content = message.get("content") or ""
+        for start in range(0, len(content), 4):
+            piece = content[start:start + 4]
+            time.sleep(self.token_delay(count_tokens(piece)))
+            yield chunk({"content": piece})
+        for index, toolcall in enumerate(message.get("tool_calls") or []):
+            yield chunk({"tool_calls": [{
+                "index": index,
+                "id": toolcall["id"],
+                "type": "function",
+                "function": {"name": toolcall["function"]["name"], "arguments": ""}
+            }]})
+            arguments = toolcall["function"]["arguments"]
+            for start in range(0, len(arguments), 16):
+                piece = arguments[start:start + 16]
+                time.sleep(self.token_delay(count_tokens(piece)))
+                yield chunk({"tool_calls": [{"index": index, "function": {"arguments": piece}}]})
+        yield chunk({}, "tool_calls" if message.get("tool_calls") else "stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            yield {**base, "choices": [], "usage": usage}
+
+
+def make_handler(mock: MockLLM):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if mock.should_fail():
+                if random.random() < 0.5:
+                    self._send_json(429, {"error": {"message": "Rate limited (mock)", "type": "rate_limit"}}, {"Retry-After": "1"})
+                else:
+                    self._send_json(503, {"error": {"message": "Service unavailable (mock)"}})
+                return
+            if not request.get("stream"):
+                self._send_json(200, mock.completion(request))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for chunk in mock.stream(request):
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8001, **kwargs) -> ThreadingHTTPServer:
+    """Start the mock server in a background thread and return it."""
+    server = ThreadingHTTPServer((host, port), make_handler(MockLLM(**kwargs)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--script", type=str, default=None, help="JSON script of canned turns (default: built-in)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay before the first token")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay per request")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Completion token rate, 0 for instant")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 429/503")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockLLM(
+        script=script,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+    )))
+    server.daemon_threads = True
+    print(f"Mock LLM server on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,145 @@
+"""
+CPU embedding backend running an int8-quantized ONNX export of a sentence-transformers model.
+
+Only onnxruntime and tokenizers are needed at runtime; torch is only needed to export:
+
+    python -m src.onnx_embeddings export all-mpnet-base-v2 models/onnx/all-mpnet-base-v2
+"""
+import os
+import json
+import logging
+import threading
+from argparse import ArgumentParser
+from typing import List, Optional, Union
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.int8.onnx"
+CONFIG_FILE = "embedding_config.json"
+
+
+def model_dir(model_name: str) -> str:
+    """Directory of the exported model under models/onnx/."""
+    return os.path.join("models", "onnx", model_name.replace("/", "_"))
+
+
+def default_model_dir(model_name: str) -> str:
+    """Where an exported model is looked up, overridable with EMBEDDING_ONNX_DIR."""
+    return os.getenv("EMBEDDING_ONNX_DIR") or model_dir(model_name)
+
+
+def export(model_name: str, output_dir: str, max_length: int = 384) -> str:
+    """Export a sentence-transformers model to ONNX and quantize it to int8.
+
+    Writes the quantized model, the tokenizer and the pooling settings to `output_dir`.
+
+    Args:
+        model_name: Name of the sentence-transformers model
+        output_dir: Folder to write to
+        max_length: Maximum sequence length the tokenizer truncates to
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    tokenizer.save_pretrained(output_dir)
+
+    max_length = min(max_length, st_model.max_seq_length or max_length)
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    normalize = any(type(module).__name__ == "Normalize" for module in st_model)
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "dimension": st_model.get_sentence_embedding_dimension(),
+            "max_length": max_length,
+            "normalize": normalize,
+        }, f, indent=2)
+    logger.info(f"Exported {model_name} to {output_dir}")
+    return output_dir
+
+
+class OnnxModel:
+    """Drop-in for `SharedModel`: mean-pooled embeddings from an ONNX session."""
+
+    def __init__(self, model_dir: str, num_threads: Optional[int] = None):
+        """Load an exported model.
+
+        Args:
+            model_dir: Folder written by `export`
+            num_threads: Intra-op threads of the onnxruntime session (default: onnxruntime's choice)
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.dimension = self.config["dimension"]
+        self.normalize = self.config["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_length"])
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        # onnxruntime sessions are thread-safe, the lock keeps batches from
+        # competing for the same cores
+        self.lock = threading.Lock()
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        outputs = [np.empty((0, self.dimension), dtype=np.float32)]
+        with self.lock:
+            for start in range(0, len(batch), batch_size):
+                encodings = self.tokenizer.encode_batch(batch[start:start + batch_size])
+                input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+                attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+                hidden = self.session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+                mask = attention_mask[..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+                if self.normalize:
+                    pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+                outputs.append(pooled.astype(np.float32))
+        embeddings = np.concatenate(outputs)
+        return embeddings[0] if single else embeddings
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description="Export sentence-transformers models for the ONNX backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export and quantize a model")
+    export_parser.add_argument("model_name", nargs="?", default="all-mpnet-base-v2")
+    export_parser.add_argument("output_dir", nargs="?", default=None)
+    export_parser.add_argument("--max-length", type=int, default=384)
+    args = parser.parse_args()
+    export(args.model_name, args.output_dir or default_model_dir(args.model_name), args.max_length)
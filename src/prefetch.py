@@ -0,0 +1,118 @@
+import re
+import logging
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+import numpy as np
+from .metrics import current_turn
+from .vector_manager import RULE_DOCUMENTS
+
+logger = logging.getLogger(__name__)
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"[\W_]+", "", text.lower())
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def lexical_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of character bigrams, works for Chinese and English."""
+    a_grams, b_grams = _bigrams(a), _bigrams(b)
+    return len(a_grams & b_grams) / len(a_grams | b_grams)
+
+
+class RetrievalPrefetcher:
+    """Speculative rule retrieval for one turn at a time.
+
+    At the start of a turn the player input embedding (already computed for
+    the module search) is used to run `search_all_rules` in the background
+    while the first completion is in flight. When the model then calls a
+    rule lookup with a query close to the player input, the answer is served
+    from the prefetched results instead of another embedding + pgvector
+    round trip. Closeness is checked lexically first; only if that fails is
+    the tool query embedded and compared by cosine similarity, which still
+    saves the database query.
+    """
+
+    def __init__(
+        self,
+        vector_manager,
+        limit: int = 20,
+        lexical_threshold: float = 0.5,
+        semantic_threshold: float = 0.85,
+        wait_timeout: float = 5.0
+    ):
+        """Initialize the prefetcher.
+
+        Args:
+            vector_manager: VectorManager used for the speculative search
+            limit: Number of results prefetched across all documents
+            lexical_threshold: Bigram similarity at which a tool query counts
+                               as the player input
+            semantic_threshold: Cosine similarity at which it does
+            wait_timeout: Seconds to wait for an unfinished prefetch
+        """
+        self.vector_manager = vector_manager
+        self.limit = limit
+        self.lexical_threshold = lexical_threshold
+        self.semantic_threshold = semantic_threshold
+        self.wait_timeout = wait_timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coc-prefetch")
+        self._player_input = ""
+        self._query_embedding: Optional[np.ndarray] = None
+        self._future: Optional[Future] = None
+
+    def start(self, player_input: str, query_embedding: np.ndarray) -> None:
+        """Start prefetching for a new turn, dropping the previous turn's cache."""
+        self._player_input = player_input
+        self._query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        # Run in a copy of the context so the database time lands in the turn metrics
+        self._future = self.executor.submit(
+            contextvars.copy_context().run,
+            self.vector_manager.search_all_rules, player_input, self.limit, self._query_embedding
+        )
+
+    def _is_similar(self, query: str) -> bool:
+        if lexical_similarity(query, self._player_input) >= self.lexical_threshold:
+            return True
+        query_embedding = np.asarray(self.vector_manager.embedding_manager.get_embedding(query), dtype=np.float32)
+        norms = np.linalg.norm(query_embedding) * np.linalg.norm(self._query_embedding)
+        return bool(norms) and float(query_embedding @ self._query_embedding / norms) >= self.semantic_threshold
+
+    def lookup(self, function_name: str, parameters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Answer a rule lookup from the prefetched results, or None on a miss."""
+        query = parameters.get("query", "")
+        if self._future is None or not query:
+            return None
+        if function_name != "search_all_rules" and function_name not in RULE_DOCUMENTS:
+            return None
+        if not self._is_similar(query):
+            return None
+        try:
+            prefetched = self._future.result(timeout=self.wait_timeout)
+        except Exception as e:
+            logger.warning(f"Rule prefetch failed: {e}")
+            return None
+        if prefetched.get("error"):
+            return None
+
+        limit = min(parameters.get("limit") or 5, self.vector_manager.max_search_limit)
+        if function_name == "search_all_rules":
+            results = prefetched["results"][:limit]
+            answer = {"query": query, "results": results}
+        else:
+            document_name = RULE_DOCUMENTS[function_name]
+            results = [r for r in prefetched["results"] if r["document"] == document_name][:limit]
+            # Too few hits in that document means the prefetch cannot stand in for a real search
+            if len(results) < limit:
+                return None
+            answer = {"query": query, "document": document_name, "results": results}
+
+        turn = current_turn()
+        if turn is not None:
+            turn.prefetch_hits += 1
+        logger.info(f"Served {function_name} from the rule prefetch")
+        return answer
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -97,8 +97,13 @@ CoC跑团强调的不是打败强大的敌人，而是探索未知、揭示真
 
 USER_PROMPT = """
 玩家行动: {player_input}
+{module_context}"""
+
+MODULE_CONTEXT_PROMPT = """<module_context>
+以下是与玩家行动相关的模组原文片段，供你推进剧情时参考，不要直接念给玩家：
+{passages}
+</module_context>
 """
-# 相关模组上下文：{module_context}
 
 functions = [
         {
@@ -495,6 +500,10 @@ functions = [
                         "query": {
                             "type": "string",
                             "description": "The query to retrieve the rules for investigator creation"
+                        },
+                        "cursor": {
+                            "type": "string",
+                            "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
                         }
                     },
                     "required": ["query"]
@@ -512,6 +521,10 @@ functions = [
                 "query": {
                     "type": "string",
                     "description": "The specific alien technology or concept the user is asking about."
+                },
+                "cursor": {
+                    "type": "string",
+                    "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
                 }
                 },
                 "required": ["query"]
@@ -529,6 +542,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The specific combat rule, action, or concept the user is asking about (e.g., 'Fighting maneuvers', 'Automatic fire rules', 'Healing a major wound', 'Surprise attack')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -546,6 +563,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The specific chase rule, phase, or concept the user is asking about (e.g., 'Setting up a chase', 'Handling hazards', 'Vehicle rules in a chase', 'Action points')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -563,6 +584,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The specific game system rule, check type, or concept the user is asking about (e.g., 'Skill checks', 'Pushing the Roll', 'Opposed checks', 'Credit Rating rules', 'Aging effects')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -580,6 +605,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The specific Keeper task, rule interpretation, game management technique, or scenario design concept the user is asking about (e.g., 'Setting check difficulty', 'Handling NPC reactions', 'Designing non-linear scenarios', 'Using handouts')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -597,6 +626,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The name of the specific creature, god, or type of mythical being the user is asking about (e.g., 'Deep One stats', 'Cthulhu's powers', 'Ghoul combat', 'Mi-Go behavior', 'Nyarlathotep forms')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -614,6 +647,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The specific sanity rule, madness type, check, or effect the user is asking about (e.g., 'Sanity checks', 'Temporary madness duration', 'Reality check', 'Sanity loss from seeing a Ghoul', 'Phobia symptoms')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -631,6 +668,10 @@ functions = [
         "query": {
           "type": "string",
           "description": "The specific skill rule, check type, individual skill description, or concept the user is asking about (e.g., 'Psychology skill', 'Pushing a Locksmith roll', 'Extreme difficulty examples', 'Combined skill checks', 'Skill specialization rules')."
+        },
+        "cursor": {
+          "type": "string",
+          "description": "Leave query empty and pass the next_cursor of a previous call to page through the whole document."
         }
       },
       "required": ["query"]
@@ -0,0 +1,80 @@
+import time
+import logging
+from typing import Optional
+from pydantic import BaseModel, Field
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TurnBudget(BaseModel):
+    """Limits on the completions a single player turn may spend."""
+    max_tool_rounds: int = Field(default=5, description="Tool-call rounds before the model must answer")
+    deadline_seconds: float = Field(default=90.0, description="Wall-clock limit for the whole turn")
+    max_tokens: int = Field(default=60000, description="Prompt + completion tokens allowed per turn")
+
+
+class ToolLoop:
+    """Book-keeping for the tool-call loop of one turn.
+
+    The loop counts completions, tool rounds and token usage against a
+    `TurnBudget`, and records why the turn stopped.
+    """
+
+    FINAL_ANSWER = "final_answer"
+    MAX_ROUNDS = "max_rounds"
+    TOKEN_BUDGET = "token_budget"
+    DEADLINE = "deadline"
+
+    def __init__(self, budget: Optional[TurnBudget] = None):
+        self.budget = budget or TurnBudget()
+        self.started_at = time.monotonic()
+        self.completions = 0
+        self.tool_rounds = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.stop_reason: Optional[str] = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        """Seconds left before the turn deadline."""
+        return max(self.budget.deadline_seconds - self.elapsed, 0.0)
+
+    def record_completion(self, usage) -> None:
+        """Count one completion and its token usage (may be None)."""
+        self.completions += 1
+        metrics.record_completion(usage)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+    def record_tool_round(self) -> Optional[str]:
+        """Count one executed tool round.
+
+        Returns:
+            The budget that is exhausted, or None if the loop may go on
+        """
+        self.tool_rounds += 1
+        if self.remaining() <= 0:
+            return self.DEADLINE
+        if self.total_tokens >= self.budget.max_tokens:
+            return self.TOKEN_BUDGET
+        if self.tool_rounds >= self.budget.max_tool_rounds:
+            return self.MAX_ROUNDS
+        return None
+
+    def finish(self, reason: str) -> None:
+        """Record why the turn stopped."""
+        self.stop_reason = reason
+        log = logger.info if reason == self.FINAL_ANSWER else logger.warning
+        log(
+            f"Turn stopped ({reason}): {self.completions} completions, "
+            f"{self.tool_rounds} tool rounds, {self.total_tokens} tokens, {self.elapsed:.1f}s"
+        )
@@ -0,0 +1,157 @@
+import re
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from .prompts import functions
+from .history import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Always offered: dice, checks and the generic rule search as a fallback
+CORE_TOOLS = ["roll_dice", "perform_skill_check", "get_investigator_status", "search_all_rules"]
+
+# Tools of each game phase, and the keywords in the player input that start it
+PHASE_TOOLS = {
+    "creation": ["create_role", "retrieve_coc_rules_investigator_creation", "retrieve_coc_rules_skills"],
+    "combat": ["start_combat", "perform_attack", "attempt_dodge", "fight_back", "apply_damage", "end_combat", "retrieve_coc_rules_combat"],
+    "chase": ["retrieve_coc_rules_chase", "apply_damage"],
+    "sanity": ["apply_sanity_damage", "check_madness", "retrieve_coc_rules_sanity"],
+    "growth": ["improve_skill", "retrieve_coc_rules_game_system"],
+}
+# Chinese keywords are matched anywhere, so they are phrases of two or more
+# characters ("打" alone would also match "打开"); English ones must be
+# whole words, optionally inflected
+PHASE_KEYWORDS = {
+    "creation": ["创建角色", "创建调查员", "建卡", "人物卡", "车卡", "职业", "属性", "character sheet", "new character", "create"],
+    "combat": ["攻击", "战斗", "打斗", "打架", "殴打", "砍向", "射击", "开枪", "闪避", "反击", "格斗", "拔枪", "拔刀",
+               "attack", "fight", "shoot", "punch", "stab"],
+    "chase": ["追逐", "追赶", "追上", "逃跑", "逃走", "逃离", "逃命", "快跑", "chase", "flee", "run away", "escape"],
+    "sanity": ["理智", "疯狂", "发疯", "恐惧", "怪物", "尸体", "san", "sanity", "madness", "insane"],
+    "growth": ["成长", "幕间", "提升技能", "improve"],
+}
+
+
+def _word_pattern(word: str) -> str:
+    """A whole English word or its -s/-ed/-ing form."""
+    if word.endswith("e"):
+        body = re.escape(word[:-1]) + "(?:e|es|ed|ing)"
+    else:
+        body = re.escape(word) + "(?:s|es|ed|ing)?"
+    return rf"(?<![a-z]){body}(?![a-z])"
+
+
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    return re.compile("|".join(_word_pattern(k) if k.isascii() else re.escape(k) for k in keywords))
+
+
+PHASE_PATTERNS = {phase: _keyword_pattern(keywords) for phase, keywords in PHASE_KEYWORDS.items()}
+
+
+def _schema_tokens(tools: List[Dict[str, Any]]) -> int:
+    return count_tokens(json.dumps(tools, ensure_ascii=False))
+
+
+class RouteDecision:
+    """Tools chosen for one turn and the prompt tokens it saves."""
+
+    def __init__(self, tools: List[Dict[str, Any]], phases: List[str], tokens_full: int):
+        self.tools = tools
+        self.names = [tool["function"]["name"] for tool in tools]
+        self.phases = phases
+        self.tokens_full = tokens_full
+        self.tokens_selected = _schema_tokens(tools)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_full - self.tokens_selected
+
+
+class ToolRouter:
+    """Picks the subset of `functions` worth sending with a turn.
+
+    The full schema costs thousands of prompt tokens per completion, mostly
+    for the long rule-retrieval descriptions. A turn gets the core tools,
+    the tools of every game phase named in the player input, the tools used
+    in the previous turn (an ongoing combat keeps its tools), and the tools
+    whose description embeddings are closest to the player input.
+    """
+
+    def __init__(self, embedding_manager=None, top_k: int = 3, min_similarity: float = 0.2,
+                 tools: Optional[List[Dict[str, Any]]] = None):
+        """Initialize the router.
+
+        Args:
+            embedding_manager: EmbeddingManager for description matching; if
+                               None only core, phase and recent tools are used
+            top_k: Number of tools added by description similarity
+            min_similarity: Cosine similarity a tool needs to be added
+            tools: Tool schemas to route over, defaults to `functions`
+        """
+        self.tools = tools or functions
+        self.by_name = {tool["function"]["name"]: tool for tool in self.tools}
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.tokens_full = _schema_tokens(self.tools)
+        self.embedding_manager = embedding_manager
+        self.description_embeddings = None
+        if embedding_manager is not None:
+            descriptions = [
+                f"{tool['function']['name']}: {tool['function'].get('description', '')}" for tool in self.tools
+            ]
+            embeddings = np.asarray(embedding_manager.get_embeddings(descriptions), dtype=np.float32)
+            self.description_embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def _phases(self, player_input: str) -> List[str]:
+        text = player_input.lower()
+        return [phase for phase, pattern in PHASE_PATTERNS.items() if pattern.search(text)]
+
+    def _similar(self, query_embedding: np.ndarray) -> List[str]:
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.description_embeddings @ query
+        best = np.argsort(-scores)[:self.top_k]
+        return [self.tools[i]["function"]["name"] for i in best if scores[i] >= self.min_similarity]
+
+    def select(self, player_input: str, query_embedding: Optional[np.ndarray] = None,
+               recent_tools: Iterable[str] = ()) -> RouteDecision:
+        """Choose the tools for a turn.
+
+        Args:
+            player_input: The player's input of this turn
+            query_embedding: Embedding of the player input, computed if missing
+            recent_tools: Names of the tools called in the previous turn
+        """
+        phases = self._phases(player_input)
+        names = list(CORE_TOOLS)
+        for phase in phases:
+            names.extend(PHASE_TOOLS[phase])
+        names.extend(recent_tools)
+        if self.description_embeddings is not None:
+            if query_embedding is None:
+                query_embedding = self.embedding_manager.get_embedding(player_input)
+            names.extend(self._similar(query_embedding))
+
+        selected = []
+        for name in dict.fromkeys(names):
+            if name in self.by_name:
+                selected.append(self.by_name[name])
+        decision = RouteDecision(selected, phases, self.tokens_full)
+        logger.info(
+            f"Routed {len(selected)}/{len(self.tools)} tools (phases: {phases or ['none']}), "
+            f"{decision.tokens_selected} instead of {decision.tokens_full} schema tokens"
+        )
+        return decision
+
+
+def recent_tool_names(messages: List[Any]) -> List[str]:
+    """Names of the tools called in the last turn of the history."""
+    names = []
+    for message in reversed(messages):
+        if hasattr(message, "model_dump"):
+            message = message.model_dump(exclude_none=True)
+        if message.get("role") == "user":
+            break
+        for toolcall in message.get("tool_calls") or []:
+            names.append(toolcall["function"]["name"])
+    return names
@@ -1,9 +1,22 @@
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any, Optional
 import logging
 from .vector_store import VectorStore
 from .embeddings import EmbeddingManager
 
+# Rule document (file name without extension) read by each retrieval function
+RULE_DOCUMENTS = {
+    "retrieve_coc_rules_skills": "skills",
+    "retrieve_coc_rules_sanity": "sanity",
+    "retrieve_coc_mythos_creatures_gods": "monster_beast_gods",
+    "retrieve_coc_rules_keeper_guide": "kp_hosting_coc",
+    "retrieve_coc_rules_game_system": "coc_core",
+    "retrieve_coc_rules_chase": "chase",
+    "retrieve_coc_rules_combat": "battle",
+    "retrieve_coc_rules_alien_technology": "aliens",
+    "retrieve_coc_rules_investigator_creation": "investigator",
+}
+
 class VectorManager:
     """Manager class to handle vector store operations and function calls."""
     
@@ -15,7 +28,10 @@ class VectorManager:
         dbname: str = "rules",
         user: str = "coc",
         password: str = "coc_rule",
-        embedding_model: str = "all-mpnet-base-v2"
+        embedding_model: str = "all-mpnet-base-v2",
+        page_size: int = 8,
+        max_result_chars: int = 4000,
+        max_search_limit: int = 10
     ):
         """Initialize the vector manager.
         
@@ -27,6 +43,9 @@ class VectorManager:
             user: Database user
             password: Database password
             embedding_model: Model name for embeddings
+            page_size: Maximum chunks per page when reading a whole document
+            max_result_chars: Character budget of one page of document content
+            max_search_limit: Upper bound on the `limit` the model may ask for
         """
         self.embedding_manager = EmbeddingManager(model_name=embedding_model)
         self.vector_store = VectorStore(
@@ -36,24 +55,29 @@ class VectorManager:
             port=port,
             dbname=dbname,
             user=user,
-            password=password
+            password=password,
+            vector_type=self.embedding_manager.postprocessor.vector_type
         )
-        logging.basicConfig(level=logging.INFO)
+        self.page_size = page_size
+        self.max_result_chars = max_result_chars
+        self.max_search_limit = max_search_limit
         self.logger = logging.getLogger(__name__)
         
-    def search_all_rules(self, query: str, limit: int = 5) -> Dict[str, Any]:
+    def search_all_rules(self, query: str, limit: int = 5, query_embedding: Optional[np.ndarray] = None) -> Dict[str, Any]:
         """Search all rule documents for relevant information.
         
         Args:
             query: The query text
             limit: Maximum number of results to return
+            query_embedding: Embedding of the query if already computed
             
         Returns:
             Dictionary with results
         """
         try:
             # Get the embedding for the query
-            query_embedding = self.embedding_manager.get_embedding(query)
+            if query_embedding is None:
+                query_embedding = self.embedding_manager.get_embedding(query)
             
             # Search across all documents
             results = self.vector_store._search_all_documents(query_embedding, limit)
@@ -120,6 +144,64 @@ class VectorManager:
                 "results": []
             }
     
+    def get_document_page(self, document_name: str, cursor: str = "") -> Dict[str, Any]:
+        """Read a document page by page instead of all at once.
+        
+        Args:
+            document_name: Name of the document to read
+            cursor: `next_cursor` of the previous page, empty for the first page
+            
+        Returns:
+            Dictionary with the chunks of this page and the cursor of the next
+            page (None at the end of the document)
+        """
+        try:
+            after, offset = None, 0
+            if cursor:
+                # "page:chunk_index" resumes after that chunk,
+                # "page:chunk_index:offset" inside it
+                parts = [int(part) for part in cursor.split(":")]
+                page, chunk_index = parts[0], parts[1]
+                offset = parts[2] if len(parts) > 2 else 0
+                after = (page, chunk_index - 1) if offset else (page, chunk_index)
+            # One extra row tells whether there is a next page
+            rows = self.vector_store.get_document_content(document_name, after=after, limit=self.page_size + 1)
+            content = []
+            used = 0
+            next_cursor = None
+            for i, row in enumerate(rows[:self.page_size]):
+                start = offset if i == 0 else 0
+                text = row["content"][start:]
+                if content and used + len(text) > self.max_result_chars:
+                    next_cursor = f"{content[-1]['page']}:{content[-1]['chunk_index']}"
+                    break
+                piece = text[:self.max_result_chars - used]
+                content.append({
+                    "page": row["page"],
+                    "chunk_index": row["chunk_index"],
+                    "content": piece
+                })
+                used += len(piece)
+                if len(piece) < len(text):
+                    # The rest of an oversized chunk comes with the next page
+                    next_cursor = f"{row['page']}:{row['chunk_index']}:{start + len(piece)}"
+                    break
+            else:
+                if len(rows) > self.page_size:
+                    next_cursor = f"{content[-1]['page']}:{content[-1]['chunk_index']}"
+            return {
+                "document": document_name,
+                "content": content,
+                "next_cursor": next_cursor
+            }
+        except Exception as e:
+            self.logger.error(f"Error retrieving document {document_name}: {e}")
+            return {
+                "document": document_name,
+                "error": str(e),
+                "content": []
+            }
+    
     def get_available_rule_documents(self) -> Dict[str, Any]:
         """Get a list of available rule documents.
         
@@ -149,45 +231,22 @@ class VectorManager:
             Function result
         """
         if function_name == "search_all_rules":
-            limit = parameters.get("limit", 5)
+            limit = min(parameters.get("limit") or 5, self.max_search_limit)
             return self.search_all_rules(parameters["query"], limit)
         
         elif function_name == "get_available_rule_documents":
             return self.get_available_rule_documents()
         
-        elif function_name in [
-            "retrieve_coc_rules_skills", 
-            "retrieve_coc_rules_sanity", 
-            "retrieve_coc_mythos_creatures_gods", 
-            "retrieve_coc_rules_keeper_guide", 
-            "retrieve_coc_rules_game_system", 
-            "retrieve_coc_rules_chase", 
-            "retrieve_coc_rules_combat", 
-            "retrieve_coc_rules_alien_technology", 
-            "retrieve_coc_rules_investigator_creation"
-        ]:
-            # Extract the document name from the function name
-            document_name = function_name.replace("retrieve_coc_rules_", "")
+        elif function_name in RULE_DOCUMENTS:
+            document_name = RULE_DOCUMENTS[function_name]
             query = parameters.get("query", "")
-            limit = parameters.get("limit", 5)
+            limit = min(parameters.get("limit") or 5, self.max_search_limit)
             
             # If query is provided, search the specific document
             if query:
                 return self.search_document(document_name, query, limit)
-            # Otherwise, return the whole document content
+            # Otherwise, page through the document content
             else:
-                try:
-                    document_content = self.vector_store.get_document_content(document_name)
-                    return {
-                        "document": document_name,
-                        "content": document_content
-                    }
-                except Exception as e:
-                    self.logger.error(f"Error retrieving document {document_name}: {e}")
-                    return {
-                        "document": document_name,
-                        "error": str(e),
-                        "content": []
-                    }
+                return self.get_document_page(document_name, parameters.get("cursor", ""))
         else:
             raise ValueError(f"Unknown function: {function_name}") 
\ No newline at end of file
@@ -1,30 +1,267 @@
-import faiss
+import os
+import math
+import time
 import numpy as np
-import psycopg2
-from psycopg2.extras import execute_values
 from typing import List, Tuple, Dict, Any, Optional
 import logging
+from .metrics import timed
+from .db_pool import get_pool
+
+
+def inner_product_index(dimension: int):
+    """Faiss index storing vectors as fp16 and ranking by inner product.
+
+    Embeddings are L2-normalized (see `EmbeddingPostprocessor`), so the
+    inner product is their cosine similarity.
+    """
+    import faiss
+    return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+
+
+# Chunks of every rule document, one row per chunk
+RULE_CHUNKS_TABLE = "coc_rules.rule_chunks"
+
+
+def document_key(document_name: str) -> str:
+    """Value of the `document` column for a file or table name, e.g. "coc_core.pdf" -> "coc_core"."""
+    return document_name.split('.')[0].lower().replace('-', '_')
+
+
+INDEX_TYPES = ("ivfflat", "hnsw")
+VECTOR_INDEX = "rule_chunks_embedding_idx"
+
+
+def ivfflat_lists(rows: int) -> int:
+    """Number of ivfflat lists for a table of `rows` rows: rows / 1000 up to
+    a million rows, sqrt(rows) above, as pgvector recommends."""
+    if rows > 1_000_000:
+        return int(math.sqrt(rows))
+    return max(1, rows // 1000)
+
+
+def index_options(index_type: str = "ivfflat", rows: int = 0) -> Dict[str, int]:
+    """Build parameters of the vector index for a table of `rows` rows."""
+    if index_type == "hnsw":
+        return {"m": 16, "ef_construction": 64}
+    return {"lists": ivfflat_lists(rows)}
+
+
+def vector_index_sql(vector_type: str = "halfvec", index_type: str = "ivfflat", rows: int = 0,
+                     name: str = VECTOR_INDEX) -> str:
+    """CREATE INDEX statement of the rule chunks' vector index.
+
+    ivfflat trains its list centroids on the rows present when the index is
+    built, so build it after loading the chunks, with `rows` set to their count.
+    """
+    options = ", ".join(f"{key} = {value}" for key, value in index_options(index_type, rows).items())
+    return f"""
+        CREATE INDEX IF NOT EXISTS {name}
+        ON {RULE_CHUNKS_TABLE} USING {index_type} (embedding {vector_type}_ip_ops)
+        WITH ({options});
+    """
+
+
+def existing_vector_index(cursor) -> Optional[Tuple[str, List[str]]]:
+    """Access method and storage options of the existing vector index
+    (e.g. ("ivfflat", ["lists=100"])), None if there is none."""
+    schema, _ = RULE_CHUNKS_TABLE.split(".")
+    cursor.execute("""
+        SELECT am.amname, c.reloptions
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE n.nspname = %s AND c.relname = %s
+    """, (schema, VECTOR_INDEX))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0], row[1] or []
+
+
+def index_is_stale(index_type: str, options: List[str], rows: int) -> bool:
+    """Whether an ivfflat index was sized for far fewer rows than the table now has."""
+    if index_type != "ivfflat":
+        return False
+    lists = next((int(option.split("=")[1]) for option in options if option.startswith("lists=")), None)
+    return lists is not None and ivfflat_lists(rows) >= 2 * lists
+
+
+def drop_vector_index(cursor) -> None:
+    """Drop the vector index, before a bulk load; the caller commits."""
+    schema, _ = RULE_CHUNKS_TABLE.split(".")
+    cursor.execute(f"DROP INDEX IF EXISTS {schema}.{VECTOR_INDEX}")
+
+
+def build_vector_index(cursor, vector_type: str = "halfvec", index_type: str = "ivfflat",
+                       rebuild: bool = False) -> Dict[str, Any]:
+    """Build the vector index sized for the rows now in the table.
+
+    Without `rebuild`, an existing index is kept. With it, the new index is
+    built under a temporary name and swapped in, so searches keep using the
+    old one while it builds. The caller commits.
+
+    Args:
+        cursor: Cursor of an open connection
+        vector_type: "halfvec" or "vector"
+        index_type: "ivfflat" or "hnsw"
+        rebuild: Replace an existing index
+
+    Returns:
+        Report of the build: index type, rows, build parameters, the type and
+        options of the previous index, whether a kept ivfflat index is stale
+        (see `index_is_stale`) and build time in seconds (0 when kept)
+    """
+    schema, _ = RULE_CHUNKS_TABLE.split(".")
+    existing = existing_vector_index(cursor)
+    cursor.execute(f"SELECT count(*) FROM {RULE_CHUNKS_TABLE}")
+    rows = cursor.fetchone()[0]
+    previous_type, previous = existing or (None, None)
+    report = {"index_type": index_type, "rows": rows, **index_options(index_type, rows),
+              "previous_type": previous_type, "previous": previous, "stale": False, "seconds": 0.0}
+    if existing is not None and not rebuild:
+        report["stale"] = index_is_stale(previous_type, previous, rows)
+        if report["stale"]:
+            logging.warning(f"The {previous_type} index ({', '.join(previous)}) was built for far fewer "
+                            f"than {rows} rows, rebuild it")
+        return report
+
+    start = time.perf_counter()
+    if existing is None:
+        cursor.execute(vector_index_sql(vector_type, index_type, rows))
+    else:
+        temporary = f"{VECTOR_INDEX}_new"
+        cursor.execute(f"DROP INDEX IF EXISTS {schema}.{temporary}")
+        cursor.execute(vector_index_sql(vector_type, index_type, rows, name=temporary))
+        drop_vector_index(cursor)
+        cursor.execute(f"ALTER INDEX {schema}.{temporary} RENAME TO {VECTOR_INDEX}")
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    logging.info(f"Built {index_type} index on {rows} rows in {report['seconds']}s "
+                 f"({', '.join(f'{k}={v}' for k, v in index_options(index_type, rows).items())})")
+    return report
+
+
+def knn_sql(vector_type: str = "halfvec", by_document: bool = False) -> str:
+    """Nearest-neighbour query over the rule chunks.
+
+    Rows are ordered by the bare `<#>` distance operator, ascending: that is
+    the form the planner can answer from the vector index. Ordering by an
+    expression of it (such as the returned `similarity`) forces a full scan.
+    Parameters: query vector, [document,] query vector, limit.
+    """
+    where_sql = "WHERE document = %s" if by_document else ""
+    return f"""
+        SELECT content, -(embedding <#> %s::{vector_type}) AS similarity, document
+        FROM {RULE_CHUNKS_TABLE}
+        {where_sql}
+        ORDER BY embedding <#> %s::{vector_type}
+        LIMIT %s
+    """
+
+
+def set_search_params(cursor, index_type: str = "ivfflat", probes: int = 10, ef_search: int = 40,
+                      filtered: bool = False) -> None:
+    """Set the index's recall/speed knob for the current transaction only.
+
+    Args:
+        cursor: Cursor of an open transaction
+        index_type: "ivfflat" or "hnsw"
+        probes: ivfflat lists visited per query
+        ef_search: Size of the hnsw candidate list
+        filtered: The query filters rows (WHERE document = ...); the index
+                  keeps scanning until enough rows pass the filter
+                  (pgvector >= 0.8 iterative scans). ivfflat only supports
+                  relaxed ordering, so callers re-sort the rows
+    """
+    if index_type == "hnsw":
+        cursor.execute("SET LOCAL hnsw.ef_search = %s", (int(ef_search),))
+        if filtered:
+            cursor.execute("SET LOCAL hnsw.iterative_scan = strict_order")
+    else:
+        cursor.execute("SET LOCAL ivfflat.probes = %s", (int(probes),))
+        if filtered:
+            cursor.execute("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+
+
+def create_rule_chunks_table(cursor, dimension: int, vector_type: str = "halfvec") -> None:
+    """Create the rule chunks table and its document index if they don't exist.
+
+    The vector index is built separately, once the chunks are loaded, see
+    `build_vector_index`.
+
+    Args:
+        cursor: Cursor of an open connection; the caller commits
+        dimension: Embedding dimension
+        vector_type: "halfvec" or "vector"
+    """
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RULE_CHUNKS_TABLE} (
+            id SERIAL PRIMARY KEY,
+            document TEXT NOT NULL,
+            page INTEGER,
+            chunk_index INTEGER,
+            content TEXT NOT NULL,
+            embedding {vector_type.upper()}({dimension}) NOT NULL
+        );
+    """)
+    # Reading a document in order, and the list of documents
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS rule_chunks_document_idx
+        ON {RULE_CHUNKS_TABLE} (document, page, chunk_index);
+    """)
+
+
+def vector_literal(embedding: np.ndarray) -> str:
+    """Text form of an embedding, cast in SQL with `::vector` or `::halfvec`."""
+    return "[" + ",".join(f"{x:.6g}" for x in np.asarray(embedding, dtype=np.float32).reshape(-1)) + "]"
+
 
 class ModuleStore:
     """Faiss vector store for the module"""
 
     def __init__(self, dimension: int = 384):
-        self.index = faiss.IndexFlatL2(dimension)
+        self.index = inner_product_index(dimension)
         self.texts = []
         
     def add_texts(self, texts: List[str], embeddings: np.ndarray):
         """Add texts and their embeddings to the store."""
         self.texts.extend(texts)
-        self.index.add(embeddings)
+        self.index.add(np.asarray(embeddings, dtype=np.float32))
         
     def search(self, query_embedding: np.ndarray, k: int = 3) -> List[Tuple[str, float]]:
-        """Search for similar texts."""
-        distances, indices = self.index.search(query_embedding.reshape(1, -1), k)
+        """Search for similar texts; scores are cosine similarities."""
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        distances, indices = self.index.search(query, k)
         results = []
         for i, idx in enumerate(indices[0]):
             if idx < len(self.texts):  # Ensure index is valid
                 results.append((self.texts[idx], float(distances[0][i])))
-        return results 
+        return results
+
+    def synopsis(self, max_chars: int = 2000) -> str:
+        """Build a compact synopsis of the module for the system prompt.
+
+        Takes the opening paragraphs (usually the background and hook) and
+        fills the rest of the budget with short paragraphs from the remainder
+        of the document, which are mostly section headings.
+        """
+        intro_budget = int(max_chars * 0.6)
+        lines = []
+        used = 0
+        rest = 0
+        for rest, text in enumerate(self.texts):
+            if used + len(text) > intro_budget:
+                break
+            lines.append(text)
+            used += len(text)
+        else:
+            return "\n".join(lines)
+        outline = [text.strip() for text in self.texts[rest:] if len(text.strip()) <= 30]
+        for heading in outline:
+            if used + len(heading) > max_chars:
+                break
+            lines.append(f"- {heading}")
+            used += len(heading)
+        return "\n".join(lines)
 
 class VectorStore:
     def __init__(self, dimension: int = 384, 
@@ -33,7 +270,11 @@ class VectorStore:
                  port: int = 5432,
                  dbname: str = "rules",
                  user: str = "coc",
-                 password: str = "coc_rule"):
+                 password: str = "coc_rule",
+                 vector_type: str = "halfvec",
+                 index_type: Optional[str] = None,
+                 probes: Optional[int] = None,
+                 ef_search: Optional[int] = None):
         """Initialize a vector store with FAISS or PostgreSQL with pgvector.
         
         Args:
@@ -45,9 +286,22 @@ class VectorStore:
             dbname: Database name (only used if use_pgvector is True)
             user: Database user (only used if use_pgvector is True)
             password: Database password (only used if use_pgvector is True)
+            vector_type: pgvector column type, "halfvec" (fp16) or "vector" (fp32).
+                         Embeddings must be L2-normalized: rows are ranked by inner product
+            index_type: Vector index, "ivfflat" or "hnsw" (default: VECTOR_INDEX_TYPE, then "ivfflat")
+            probes: ivfflat lists searched per query (default: VECTOR_PROBES, then 10)
+            ef_search: hnsw candidate list size per query (default: VECTOR_EF_SEARCH, then 40)
         """
+        if vector_type not in ("halfvec", "vector"):
+            raise ValueError(f"Unsupported pgvector type: {vector_type}")
         self.dimension = dimension
         self.use_pgvector = use_pgvector
+        self.vector_type = vector_type
+        self.index_type = index_type or os.getenv("VECTOR_INDEX_TYPE", "ivfflat")
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported vector index type: {self.index_type}")
+        self.probes = probes or int(os.getenv("VECTOR_PROBES", "10"))
+        self.ef_search = ef_search or int(os.getenv("VECTOR_EF_SEARCH", "40"))
         
         if use_pgvector:
             self.connection_params = {
@@ -61,7 +315,7 @@ class VectorStore:
             self._initialize_db()
         else:
             # Use FAISS for local vector storage
-            self.index = faiss.IndexFlatL2(dimension)
+            self.index = inner_product_index(dimension)
             self.texts = []
     
     def _initialize_db(self) -> None:
@@ -86,10 +340,10 @@ class VectorStore:
             conn.close()
     
     def _get_connection(self):
-        """Get a connection to the PostgreSQL database."""
+        """Borrow a connection from the shared pool; `close()` returns it."""
         if not self.use_pgvector:
             raise ValueError("PostgreSQL connection requested but use_pgvector is False")
-        return psycopg2.connect(**self.connection_params)
+        return get_pool(**self.connection_params).getconn()
         
     def add_texts(self, texts: List[str], embeddings: np.ndarray, document_name: Optional[str] = None):
         """Add texts and their embeddings to the store.
@@ -108,20 +362,23 @@ class VectorStore:
         else:
             # Add to FAISS
             self.texts.extend(texts)
-            self.index.add(embeddings)
+            self.index.add(np.asarray(embeddings, dtype=np.float32))
     
     def _add_to_pgvector(self, texts: List[str], embeddings: np.ndarray, document_name: str):
         """Add texts and embeddings to PostgreSQL with pgvector.
         
+        An existing vector index is kept up to date; a new table has none
+        until `build_index` is called after the load.
+        
         Args:
             texts: List of text strings
             embeddings: NumPy array of embeddings
-            document_name: Name of document for table name
+            document_name: Name of the document the texts belong to
         """
-        table_name = document_name.split('.')[0].lower().replace('-', '_')
+        document = document_key(document_name)
         
         # Create table if it doesn't exist
-        self._create_table(table_name)
+        self._create_table()
         
         # Store embeddings in database
         conn = self._get_connection()
@@ -131,57 +388,59 @@ class VectorStore:
                 data = []
                 for i, (text, embedding) in enumerate(zip(texts, embeddings)):
                     # Using 1 as placeholder for page since we don't have page info
-                    data.append((1, i, text, embedding.tolist()))
+                    data.append((document, 1, i, text, vector_literal(embedding)))
                 
                 # Batch insert
+                from psycopg2.extras import execute_values
                 execute_values(
                     cursor,
                     f"""
-                    INSERT INTO coc_rules.{table_name} 
-                    (page, chunk_index, content, embedding) 
+                    INSERT INTO {RULE_CHUNKS_TABLE} 
+                    (document, page, chunk_index, content, embedding) 
                     VALUES %s
                     """,
                     data,
-                    template="(%s, %s, %s, %s)"
+                    template=f"(%s, %s, %s, %s, %s::{self.vector_type})"
                 )
                 
                 conn.commit()
-                logging.info(f"Stored {len(texts)} chunks in table {table_name}")
+                logging.info(f"Stored {len(texts)} chunks of {document}")
         except Exception as e:
             logging.error(f"Error adding texts to pgvector: {e}")
         finally:
             conn.close()
     
-    def _create_table(self, table_name: str):
-        """Create a table for vector storage if it doesn't exist."""
+    def _create_table(self):
+        """Create the rule chunks table if it doesn't exist."""
         conn = self._get_connection()
         try:
             with conn.cursor() as cursor:
-                # Create table with vector support
-                cursor.execute(f"""
-                    CREATE TABLE IF NOT EXISTS coc_rules.{table_name} (
-                        id SERIAL PRIMARY KEY,
-                        page INTEGER,
-                        chunk_index INTEGER,
-                        content TEXT NOT NULL,
-                        embedding VECTOR({self.dimension}) NOT NULL
-                    );
-                """)
-                
-                # Create vector index
-                cursor.execute(f"""
-                    CREATE INDEX IF NOT EXISTS {table_name}_embedding_idx 
-                    ON coc_rules.{table_name} USING ivfflat (embedding vector_cosine_ops)
-                    WITH (lists = 100);
-                """)
-                
+                create_rule_chunks_table(cursor, self.dimension, self.vector_type)
                 conn.commit()
-                logging.info(f"Created table coc_rules.{table_name}")
+                logging.info(f"Created table {RULE_CHUNKS_TABLE}")
         except Exception as e:
             logging.error(f"Error creating table: {e}")
         finally:
             conn.close()
     
+    def build_index(self, rebuild: bool = False) -> Dict[str, Any]:
+        """Build the vector index once the texts are added, see `build_vector_index`.
+        
+        Args:
+            rebuild: Replace an existing index, e.g. after the table has grown
+            
+        Returns:
+            Report of the build
+        """
+        conn = self._get_connection()
+        try:
+            with conn.cursor() as cursor:
+                report = build_vector_index(cursor, self.vector_type, self.index_type, rebuild)
+                conn.commit()
+                return report
+        finally:
+            conn.close()
+    
     def search(self, query_embedding: np.ndarray, k: int = 3, 
                document_name: Optional[str] = None) -> List[Tuple[str, float]]:
         """Search for similar texts.
@@ -199,7 +458,8 @@ class VectorStore:
             return self._search_pgvector(query_embedding, k, document_name)
         else:
             # Search in FAISS
-            distances, indices = self.index.search(query_embedding.reshape(1, -1), k)
+            query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            distances, indices = self.index.search(query, k)
             results = []
             for i, idx in enumerate(indices[0]):
                 if idx < len(self.texts):  # Ensure index is valid
@@ -237,23 +497,20 @@ class VectorStore:
         Returns:
             List of (text, score, document_name) tuples
         """
-        table_name = document_name.split('.')[0].lower().replace('-', '_')
+        document = document_key(document_name)
         
         conn = self._get_connection()
         try:
-            with conn.cursor() as cursor:
-                cursor.execute(f"""
-                    SELECT content, 1 - (embedding <=> %s) AS similarity
-                    FROM coc_rules.{table_name}
-                    ORDER BY similarity DESC
-                    LIMIT %s
-                """, (query_embedding.tolist(), limit))
+            with timed("db"), conn.cursor() as cursor:
+                set_search_params(cursor, self.index_type, self.probes, self.ef_search, filtered=True)
+                query = vector_literal(query_embedding)
+                cursor.execute(knn_sql(self.vector_type, by_document=True), (query, document, query, limit))
                 
                 results = []
-                for content, similarity in cursor.fetchall():
-                    results.append((content, float(similarity), table_name))
+                for content, similarity, _ in cursor.fetchall():
+                    results.append((content, float(similarity), document))
                 
-                return results
+                return sorted(results, key=lambda r: r[1], reverse=True)
         except Exception as e:
             logging.error(f"Error searching document: {e}")
             return []
@@ -271,36 +528,15 @@ class VectorStore:
         Returns:
             List of (text, score, document_name) tuples
         """
-        results = []
         conn = self._get_connection()
         try:
-            with conn.cursor() as cursor:
-                # Get all tables in our schema
-                cursor.execute("""
-                    SELECT table_name 
-                    FROM information_schema.tables
-                    WHERE table_schema = 'coc_rules'
-                """)
-                
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                # Search each table
-                for table in tables:
-                    cursor.execute(f"""
-                        SELECT content, 1 - (embedding <=> %s) AS similarity
-                        FROM coc_rules.{table}
-                        ORDER BY similarity DESC
-                        LIMIT %s
-                    """, (query_embedding.tolist(), limit))
-                    
-                    for content, similarity in cursor.fetchall():
-                        # Include the document name (table name) in the results
-                        results.append((content, float(similarity), table))
+            with timed("db"), conn.cursor() as cursor:
+                # One query over the shared index, whatever the number of documents
+                set_search_params(cursor, self.index_type, self.probes, self.ef_search)
+                query = vector_literal(query_embedding)
+                cursor.execute(knn_sql(self.vector_type), (query, query, limit))
                 
-                # Sort by similarity across all tables
-                results.sort(key=lambda x: x[1], reverse=True)
-                # Return top k results
-                return results[:limit]
+                return [(content, float(similarity), document) for content, similarity, document in cursor.fetchall()]
         except Exception as e:
             logging.error(f"Error searching all documents: {e}")
             return []
@@ -308,7 +544,7 @@ class VectorStore:
             conn.close()
             
     def get_available_documents(self) -> List[str]:
-        """Get a list of available document tables in the database.
+        """Get the names of the rule documents in the database.
         
         Returns:
             List of document names
@@ -318,11 +554,11 @@ class VectorStore:
             
         conn = self._get_connection()
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT table_name 
-                    FROM information_schema.tables
-                    WHERE table_schema = 'coc_rules'
+            with timed("db"), conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT DISTINCT document
+                    FROM {RULE_CHUNKS_TABLE}
+                    ORDER BY document
                 """)
                 
                 return [row[0] for row in cursor.fetchall()]
@@ -332,11 +568,15 @@ class VectorStore:
         finally:
             conn.close()
             
-    def get_document_content(self, document_name: str) -> List[Dict[str, Any]]:
-        """Get the full content of a document.
+    def get_document_content(self, document_name: str, after: Optional[Tuple[int, int]] = None,
+                             limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get the content of a document, in reading order.
         
         Args:
             document_name: Name of the document to retrieve
+            after: (page, chunk_index) of the last chunk already read; only
+                   chunks after it are returned (keyset pagination)
+            limit: Maximum number of chunks to return, None for all
             
         Returns:
             List of document chunks with their content
@@ -344,16 +584,20 @@ class VectorStore:
         if not self.use_pgvector:
             return []
             
-        table_name = document_name.split('.')[0].lower().replace('-', '_')
+        after_sql = "AND (page, chunk_index) > (%s, %s)" if after else ""
+        limit_sql = "LIMIT %s" if limit else ""
+        params = [document_key(document_name)] + (list(after) if after else []) + ([limit] if limit else [])
         
         conn = self._get_connection()
         try:
-            with conn.cursor() as cursor:
+            with timed("db"), conn.cursor() as cursor:
                 cursor.execute(f"""
                     SELECT id, page, chunk_index, content
-                    FROM coc_rules.{table_name}
+                    FROM {RULE_CHUNKS_TABLE}
+                    WHERE document = %s {after_sql}
                     ORDER BY page, chunk_index
-                """)
+                    {limit_sql}
+                """, params)
                 
                 results = []
                 for id, page, chunk_index, content in cursor.fetchall():
@@ -0,0 +1,50 @@
+import logging
+from src.vector_manager import VectorManager
+
+
+class FakeStore:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def get_document_content(self, document_name, after=None, limit=None):
+        rows = [row for row in self.rows if after is None or (row["page"], row["chunk_index"]) > after]
+        return rows[:limit]
+
+
+def _manager(rows, page_size=2, max_result_chars=10):
+    # Skip __init__: no embedding model or database needed to page
+    manager = VectorManager.__new__(VectorManager)
+    manager.vector_store = FakeStore(rows)
+    manager.page_size = page_size
+    manager.max_result_chars = max_result_chars
+    manager.max_search_limit = 10
+    manager.logger = logging.getLogger(__name__)
+    return manager
+
+
+def test_paging_reads_oversized_chunks_in_full():
+    rows = [
+        {"page": 1, "chunk_index": 0, "content": "a" * 25},
+        {"page": 1, "chunk_index": 1, "content": "b" * 5},
+        {"page": 2, "chunk_index": 0, "content": "c" * 8},
+    ]
+    manager = _manager(rows)
+    cursor, text, pages = "", "", 0
+    while True:
+        result = manager.get_document_page("coc_core.pdf", cursor)
+        assert sum(len(item["content"]) for item in result["content"]) <= manager.max_result_chars
+        text += "".join(item["content"] for item in result["content"])
+        pages += 1
+        cursor = result["next_cursor"]
+        if not cursor:
+            break
+    assert text == "a" * 25 + "b" * 5 + "c" * 8
+    assert pages == 4
+
+
+def test_null_limit_uses_default(monkeypatch):
+    manager = _manager([])
+    calls = []
+    monkeypatch.setattr(manager, "search_all_rules", lambda query, limit: calls.append(limit))
+    manager.function_calling("search_all_rules", {"query": "理智", "limit": None})
+    assert calls == [5]
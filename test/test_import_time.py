@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only load on first use
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "faiss", "psycopg2", "onnxruntime", "openai"]
+
+# Seconds; generous for slow CI machines, override to tighten locally
+IMPORT_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "3.0"))
+
+
+def _run(code: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_game_import_is_light():
+    report = _run(
+        "import sys, json, time\n"
+        "start = time.perf_counter()\n"
+        "import src.game, src.component_manager\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'seconds': elapsed, 'heavy': heavy,\n"
+        "                  'vector_manager_built': src.component_manager._vector_manager is not None}))"
+    )
+    assert report["heavy"] == []
+    assert not report["vector_manager_built"]
+    assert report["seconds"] < IMPORT_BUDGET, f"import src.game took {report['seconds']:.2f}s"
+
+
+def test_cli_help_skips_game_import():
+    report = _run(
+        "import sys, json, time, runpy\n"
+        "start = time.perf_counter()\n"
+        "sys.argv = ['main.py', '--help']\n"
+        "try:\n"
+        "    runpy.run_path('main.py', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'game_imported': 'src.game' in sys.modules}))"
+    )
+    assert not report["game_imported"]
+    assert report["seconds"] < IMPORT_BUDGET
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIStatusError
+
+from src.llm_client import Endpoint, ResilientClient
+
+
+def _status_error(status):
+    request = httpx.Request("POST", "http://llm.invalid/chat/completions")
+    return APIStatusError(f"HTTP {status}", response=httpx.Response(status, request=request), body=None)
+
+
+class FakeEndpointClient:
+    """Stands in for `OpenAI`; raises `error` or answers with `reply`."""
+
+    def __init__(self, error=None, reply="ok"):
+        self.calls = 0
+        self.error = error
+        self.reply = reply
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=self.create)))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(headers={}, parse=lambda: self.reply)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+
+    def make(*fakes):
+        endpoints = [Endpoint(base_url=f"http://llm{i}.invalid", model="m") for i in range(len(fakes))]
+        client = ResilientClient(endpoints, base_delay=0.0)
+        client.clients = {endpoint.name: fake for endpoint, fake in zip(endpoints, fakes)}
+        return client
+    return make
+
+
+@pytest.mark.parametrize("status", [401, 403, 404])
+def test_endpoint_errors_fail_over(client, status):
+    broken, healthy = FakeEndpointClient(_status_error(status)), FakeEndpointClient()
+    assert client(broken, healthy).create(model="m", messages=[]) == "ok"
+    assert broken.calls == 1 and healthy.calls == 1
+
+
+def test_endpoint_errors_on_every_endpoint_raise(client):
+    fakes = [FakeEndpointClient(_status_error(401)), FakeEndpointClient(_status_error(404))]
+    with pytest.raises(APIStatusError):
+        client(*fakes).create(model="m", messages=[])
+    # Not retried after every endpoint refused
+    assert [fake.calls for fake in fakes] == [1, 1]
+
+
+@pytest.mark.parametrize("status", [400, 422])
+def test_bad_requests_are_not_retried(client, status):
+    broken, healthy = FakeEndpointClient(_status_error(status)), FakeEndpointClient()
+    with pytest.raises(APIStatusError):
+        client(broken, healthy).create(model="m", messages=[])
+    assert healthy.calls == 0
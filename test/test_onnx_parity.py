@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+pytest.importorskip("sentence_transformers")
+
+from src.embeddings import get_model
+from src.onnx_embeddings import OnnxModel, export
+
+MODEL_NAME = "all-mpnet-base-v2"
+
+TEXTS = [
+    "我走进图书馆，环顾四周。",
+    "I want to make a Spot Hidden check on the desk.",
+    "理智检定失败会发生什么？",
+    "The deep one lunges at Armitage with its claws.",
+    "追逐规则中如何计算移动速度",
+]
+
+
+@pytest.fixture(scope="module")
+def onnx_model(tmp_path_factory):
+    model_dir = os.getenv("EMBEDDING_ONNX_DIR") or export(MODEL_NAME, str(tmp_path_factory.mktemp("onnx")))
+    return OnnxModel(model_dir)
+
+
+def test_onnx_matches_torch(onnx_model):
+    expected = get_model(MODEL_NAME, device="cpu", backend="torch").encode(TEXTS)
+    actual = onnx_model.encode(TEXTS)
+    assert actual.shape == expected.shape
+    cosine = (actual * expected).sum(axis=1) / (
+        np.linalg.norm(actual, axis=1) * np.linalg.norm(expected, axis=1)
+    )
+    assert cosine.min() > 0.99, cosine
+
+
+def test_onnx_single_text(onnx_model):
+    batch = onnx_model.encode(TEXTS[:2])
+    single = onnx_model.encode(TEXTS[0])
+    assert single.shape == (onnx_model.dimension,)
+    # Dynamic int8 quantization scales activations per batch, so padding
+    # shifts the embedding slightly; it must still point the same way
+    cosine = single @ batch[0] / (np.linalg.norm(single) * np.linalg.norm(batch[0]))
+    assert cosine > 0.99, cosine
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from src.prefetch import RetrievalPrefetcher
+
+RESULTS = [{"document": "sanity", "content": f"理智规则 {i}", "similarity": 0.9 - i / 100} for i in range(12)]
+
+
+class FakeVectorManager:
+    max_search_limit = 10
+
+    def search_all_rules(self, query, limit, query_embedding=None):
+        return {"query": query, "results": RESULTS[:limit]}
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = RetrievalPrefetcher(FakeVectorManager())
+    prefetcher.start("理智检定失败会怎样", np.ones(4))
+    yield prefetcher
+    prefetcher.close()
+
+
+@pytest.mark.parametrize("parameters, expected", [
+    ({}, 5),
+    ({"limit": None}, 5),
+    ({"limit": 3}, 3),
+    ({"limit": 50}, 10),
+])
+def test_lookup_limit(prefetcher, parameters, expected):
+    answer = prefetcher.lookup("search_all_rules", {"query": "理智检定失败会怎样", **parameters})
+    assert len(answer["results"]) == expected
+
+
+def test_document_lookup_with_null_limit(prefetcher):
+    answer = prefetcher.lookup("retrieve_coc_rules_sanity", {"query": "理智检定失败会怎样", "limit": None})
+    assert answer["document"] == "sanity" and len(answer["results"]) == 5
@@ -0,0 +1,161 @@
+"""How a turn ends when the tool loop stops, against a scripted LLM client."""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APITimeoutError
+from openai.types.chat import ChatCompletionChunk
+
+from src import llm
+from src.llm import DEADLINE_REPLY, AsyncLLMManager, LLMManager
+from src.tool_loop import ToolLoop, TurnBudget
+
+ANSWER = "你推开了门。"
+
+
+def _usage(tokens):
+    return SimpleNamespace(prompt_tokens=tokens, completion_tokens=0, total_tokens=tokens)
+
+
+def _tool_call(index=0):
+    return SimpleNamespace(id=f"call_{index}", type="function",
+                           function=SimpleNamespace(name="roll_dice", arguments='{"dice_num": 1, "faces": 100}'))
+
+
+def _completion(content=None, tool_calls=None, tokens=10):
+    message = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=_usage(tokens))
+
+
+def _stream(content=None, tool_calls=None, tokens=10):
+    """Real chunks, as the SDK parses them: the final chunk's usage is a plain dict."""
+    def chunk(choices, **extra):
+        return ChatCompletionChunk.model_validate({
+            "id": "chunk", "object": "chat.completion.chunk", "created": 0, "model": "test",
+            "choices": choices, **extra,
+        })
+
+    chunks = []
+    if content:
+        chunks.append(chunk([{"index": 0, "delta": {"content": content}}]))
+    for call in tool_calls or []:
+        fragment = {"index": 0, "id": call.id, "type": "function",
+                    "function": {"name": call.function.name, "arguments": call.function.arguments}}
+        chunks.append(chunk([{"index": 0, "delta": {"tool_calls": [fragment]}}]))
+    chunks.append(chunk([], usage={"prompt_tokens": tokens, "completion_tokens": 0, "total_tokens": tokens}))
+    return iter(chunks)
+
+
+class ScriptedClient:
+    """Serves the queued replies in order; an exception instance is raised instead."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def _next(self, kwargs):
+        self.requests.append(kwargs)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        if kwargs.get("stream"):
+            return _stream(**reply)
+        return _completion(**reply)
+
+    def create(self, **kwargs):
+        return self._next(kwargs)
+
+
+class AsyncScriptedClient(ScriptedClient):
+    async def create(self, **kwargs):
+        return self._next(kwargs)
+
+    async def close(self):
+        pass
+
+
+def _timeout():
+    return APITimeoutError(request=httpx.Request("POST", "http://llm.invalid/chat/completions"))
+
+
+TOOL_ROUND = {"tool_calls": [_tool_call()]}
+
+# stop reason -> (budget, scripted replies, expected reply, expected requests)
+SCENARIOS = {
+    ToolLoop.FINAL_ANSWER: (TurnBudget(), [TOOL_ROUND, {"content": ANSWER}], ANSWER, 2),
+    ToolLoop.MAX_ROUNDS: (TurnBudget(max_tool_rounds=1), [TOOL_ROUND, {"content": ANSWER}], ANSWER, 2),
+    ToolLoop.TOKEN_BUDGET: (TurnBudget(max_tokens=50), [{**TOOL_ROUND, "tokens": 100}, {"content": ANSWER}], ANSWER, 2),
+    ToolLoop.DEADLINE: (TurnBudget(), [TOOL_ROUND, _timeout()], DEADLINE_REPLY, 2),
+    "deadline_after_tools": (TurnBudget(deadline_seconds=0), [TOOL_ROUND], DEADLINE_REPLY, 1),
+}
+
+
+@pytest.fixture
+def make_manager(monkeypatch):
+    def make(cls, client, budget):
+        monkeypatch.setattr(llm.ResilientClient, "from_env", classmethod(lambda c, model: client))
+        monkeypatch.setattr(llm.AsyncResilientClient, "from_env", classmethod(lambda c, model: client))
+        return cls(budget=budget, tool_handler=lambda name, parameters: {"result": 42})
+    return make
+
+
+def _check(manager, client, history, reply, scenario):
+    _, _, expected_reply, expected_requests = SCENARIOS[scenario]
+    stop_reason = ToolLoop.DEADLINE if scenario == "deadline_after_tools" else scenario
+    assert manager.last_loop.stop_reason == stop_reason
+    assert reply == expected_reply
+    assert len(client.requests) == expected_requests
+    wrap_up = scenario in (ToolLoop.MAX_ROUNDS, ToolLoop.TOKEN_BUDGET)
+    assert (client.requests[-1].get("tool_choice") == "none") == wrap_up
+    # Every tool call in the history has its result
+    assert history[-1]["role"] == "tool"
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_get_response_stop_reasons(make_manager, scenario):
+    budget, replies, _, _ = SCENARIOS[scenario]
+    client = ScriptedClient(replies)
+    manager = make_manager(LLMManager, client, budget)
+    history, reply = manager.get_response([], "开门")
+    _check(manager, client, history, reply, scenario)
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_stream_response_stop_reasons(make_manager, scenario):
+    budget, replies, _, _ = SCENARIOS[scenario]
+    client = ScriptedClient(replies)
+    manager = make_manager(LLMManager, client, budget)
+    stream = manager.stream_response([], "开门")
+    streamed = []
+    try:
+        while True:
+            streamed.append(next(stream))
+    except StopIteration as stop:
+        history, reply = stop.value
+    _check(manager, client, history, reply, scenario)
+    # The player sees the reply even when the model never produced one
+    assert "".join(streamed).endswith(reply)
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_async_get_response_stop_reasons(make_manager, scenario):
+    budget, replies, _, _ = SCENARIOS[scenario]
+    client = AsyncScriptedClient(replies)
+    manager = make_manager(AsyncLLMManager, client, budget)
+
+    async def turn():
+        try:
+            return await manager.get_response([], "开门")
+        finally:
+            await manager.aclose()
+
+    history, reply = asyncio.run(turn())
+    _check(manager, client, history, reply, scenario)
+
+
+def test_async_manager_does_not_stream(make_manager):
+    manager = make_manager(AsyncLLMManager, AsyncScriptedClient([]), TurnBudget())
+    with pytest.raises(NotImplementedError):
+        manager.stream_response([], "开门")
+    asyncio.run(manager.aclose())
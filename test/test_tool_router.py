@@ -0,0 +1,15 @@
+import pytest
+from src.tool_router import ToolRouter
+
+
+@pytest.mark.parametrize("player_input, phases", [
+    ("我打开抽屉看看", []),
+    ("I keep running my hand over the sand", []),
+    ("我拔枪射击那个怪物", ["combat", "sanity"]),
+    ("We run away from the deep ones!", ["chase"]),
+    ("The cultist attacks me, I fight back", ["combat"]),
+    ("进行一次SAN check", ["sanity"]),
+    ("我想建卡，职业是记者", ["creation"]),
+])
+def test_phase_keywords(player_input, phases):
+    assert ToolRouter()._phases(player_input) == phases
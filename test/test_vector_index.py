@@ -0,0 +1,23 @@
+from src.vector_store import index_is_stale, index_options, ivfflat_lists, vector_index_sql
+
+
+def test_ivfflat_lists_follow_row_count():
+    assert ivfflat_lists(0) == 1
+    assert ivfflat_lists(500) == 1
+    assert ivfflat_lists(25_000) == 25
+    assert ivfflat_lists(1_000_000) == 1000
+    assert ivfflat_lists(4_000_000) == 2000
+
+
+def test_index_sql_uses_sized_parameters():
+    assert "lists = 25" in vector_index_sql("halfvec", "ivfflat", rows=25_000)
+    sql = vector_index_sql("vector", "hnsw", rows=25_000)
+    assert "USING hnsw (embedding vector_ip_ops)" in sql and "lists" not in sql
+    assert index_options("hnsw") == {"m": 16, "ef_construction": 64}
+
+
+def test_stale_ivfflat_index():
+    assert not index_is_stale("ivfflat", ["lists=100"], 150_000)
+    assert index_is_stale("ivfflat", ["lists=100"], 200_000)
+    assert index_is_stale("ivfflat", ["lists=1"], 2_000)
+    assert not index_is_stale("hnsw", ["m=16", "ef_construction=64"], 10_000_000)
@@ -0,0 +1,126 @@
+"""
+Query plans of the rule search against a real pgvector database.
+
+Point PGVECTOR_TEST_DSN at a throwaway database (its coc_rules.rule_chunks
+table is dropped), e.g. from `docker compose up`:
+
+    PGVECTOR_TEST_DSN="host=localhost port=5432 dbname=rules_test user=coc password=coc_rule" python -m pytest test/
+"""
+import os
+import numpy as np
+import pytest
+
+DSN = os.getenv("PGVECTOR_TEST_DSN")
+if not DSN:
+    pytest.skip("PGVECTOR_TEST_DSN is not set", allow_module_level=True)
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("faiss")
+
+from psycopg2.extensions import parse_dsn
+from src.embedding_postprocess import l2_normalize
+from src.vector_store import RULE_CHUNKS_TABLE, VectorStore, knn_sql, set_search_params, vector_literal
+
+DIMENSION = 16
+ROWS = 2000
+
+
+def _plan(store: VectorStore, sql: str, params, filtered: bool = False) -> str:
+    conn = store._get_connection()
+    try:
+        with conn.cursor() as cursor:
+            # The table is small enough for a sequential scan to look cheaper;
+            # what matters is whether the index can serve the query at all
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            set_search_params(cursor, store.index_type, store.probes, store.ef_search, filtered)
+            cursor.execute("EXPLAIN " + sql, params)
+            return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        conn.close()
+
+
+@pytest.fixture(params=["ivfflat", "hnsw"])
+def store(request):
+    params = parse_dsn(DSN)
+    store = VectorStore(
+        dimension=DIMENSION, use_pgvector=True, host=params.get("host", "localhost"),
+        port=int(params.get("port", 5432)), dbname=params["dbname"], user=params.get("user"),
+        password=params.get("password"), index_type=request.param,
+    )
+    conn = store._get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {RULE_CHUNKS_TABLE}")
+            conn.commit()
+    finally:
+        conn.close()
+    store._create_table()
+
+    rng = np.random.default_rng(0)
+    embeddings = l2_normalize(rng.normal(size=(ROWS, DIMENSION)))
+    half = ROWS // 2
+    store.add_texts([f"a{i}" for i in range(half)], embeddings[:half], document_name="doc_a.pdf")
+    store.add_texts([f"b{i}" for i in range(half)], embeddings[half:], document_name="doc_b.pdf")
+    report = store.build_index()
+    assert report["rows"] == ROWS
+    conn = store._get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"ANALYZE {RULE_CHUNKS_TABLE}")
+            conn.commit()
+    finally:
+        conn.close()
+    yield store
+
+    conn = store._get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {RULE_CHUNKS_TABLE}")
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def test_search_uses_vector_index(store):
+    query = vector_literal(l2_normalize(np.ones(DIMENSION)))
+    plan = _plan(store, knn_sql(store.vector_type), (query, query, 5))
+    assert "rule_chunks_embedding_idx" in plan, plan
+
+
+def test_similarity_ordering_cannot_use_index(store):
+    # The form the search used before: ordering by an expression of the distance
+    query = vector_literal(l2_normalize(np.ones(DIMENSION)))
+    plan = _plan(store, f"""
+        SELECT content, -(embedding <#> %s::{store.vector_type}) AS similarity
+        FROM {RULE_CHUNKS_TABLE}
+        ORDER BY similarity DESC
+        LIMIT %s
+    """, (query, 5))
+    assert "rule_chunks_embedding_idx" not in plan, plan
+
+
+def test_search_results_are_ranked(store):
+    query = l2_normalize(np.ones(DIMENSION))
+    results = store._search_all_documents(query, limit=5)
+    assert len(results) == 5
+    similarities = [similarity for _, similarity, _ in results]
+    assert similarities == sorted(similarities, reverse=True)
+
+    in_document = store._search_document("doc_b.pdf", query, limit=3)
+    assert in_document and all(document == "doc_b" for _, _, document in in_document)
+
+
+def test_filtered_search_uses_vector_index(store):
+    query = vector_literal(l2_normalize(np.ones(DIMENSION)))
+    plan = _plan(store, knn_sql(store.vector_type, by_document=True), (query, "doc_a", query, 5), filtered=True)
+    assert "rule_chunks_embedding_idx" in plan, plan
+
+
+def test_filtered_search_is_not_starved(store):
+    # Half of the candidates an index scan visits belong to the other
+    # document; iterative scans keep going until the limit is filled
+    store.probes, store.ef_search = 1, 10
+    query = l2_normalize(np.ones(DIMENSION))
+    results = store._search_document("doc_a.pdf", query, limit=10)
+    assert len(results) == 10
+    similarities = [similarity for _, similarity, _ in results]
+    assert similarities == sorted(similarities, reverse=True)